@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Semantic cache for answers, matching new queries to similar earlier ones"""
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Hashable,
+    List,
+)
+
+import numpy as np
+
+from constants import (
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_TTL,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    key: Hashable
+    embedding: np.ndarray
+    answer: str
+    created: float
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32)
+    return vec / (np.linalg.norm(vec) or 1.0)
+
+
+class AnswerCache:
+    """LRU cache with TTL. An answer is reused if its query embedding is at least
+    `threshold` cosine-similar to the new one and was produced under the same key,
+    i.e., the same law filter, cited paragraphs, model, number of chunks, and
+    collection version.
+    """
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_SIMILARITY,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding: List[float], key: Hashable) -> str | None:
+        query = _normalize(embedding)
+        now = time.time()
+        with self._lock:
+            expired = [
+                i for i, e in self._entries.items() if now - e.created > self.ttl
+            ]
+            for i in expired:
+                del self._entries[i]
+            candidates = [(i, e) for i, e in self._entries.items() if e.key == key]
+            if candidates:
+                sims = np.stack([e.embedding for _, e in candidates]) @ query
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    logger.info(f"Answer cache hit with similarity {sims[best]:.3f}.")
+                    return entry.answer
+            self.misses += 1
+            return None
+
+    def add(self, embedding: List[float], key: Hashable, answer: str) -> None:
+        with self._lock:
+            self._entries[self._next_id] = CachedAnswer(
+                key=key,
+                embedding=_normalize(embedding),
+                answer=answer,
+                created=time.time(),
+            )
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
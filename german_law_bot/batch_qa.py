@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Answer a JSONL file of questions, e.g., to pre-answer FAQs or for regression checks.
+Each input line holds a `question` and optionally an `id`, `laws`, and `n_results`.
+Each output line holds the answer, its sources, and timings in seconds.
+"""
+import argparse
+import json
+import logging
+import time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import (
+    Dict,
+    List,
+)
+
+from constants import (
+    BASE_CHAT_MODEL,
+    BATCH_QA_MAX_WORKERS,
+    EMBEDDING_BATCH_SIZE,
+    HYBRID_CANDIDATE_FACTOR,
+)
+from qa import (
+    answer_rag_prompt,
+    prepare_rag_query,
+    set_law_filter,
+)
+from retrievers import get_retriever
+from utils import get_embeddings
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Question:
+    id: str | int
+    question: str
+    laws: List[str] | None = None
+    n_results: int = 3
+    embedding: List[float] = None
+    candidates: List[tuple] = None
+    embedding_time: float = 0.0
+    retrieval_time: float = 0.0
+
+
+def read_questions(path: str, n_results: int = 3) -> List[Question]:
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            questions.append(
+                Question(
+                    id=data.get("id", i),
+                    question=data["question"],
+                    laws=data.get("laws") or None,
+                    n_results=data.get("n_results", n_results),
+                )
+            )
+    return questions
+
+
+def embed_questions(
+    questions: List[Question], batch_size: int = EMBEDDING_BATCH_SIZE
+) -> None:
+    for i in range(0, len(questions), batch_size):
+        batch = questions[i : i + batch_size]
+        start = time.perf_counter()
+        embeddings = get_embeddings([q.question for q in batch])
+        elapsed = (time.perf_counter() - start) / len(batch)
+        for q, e in zip(batch, embeddings):
+            q.embedding, q.embedding_time = e, elapsed
+
+
+def retrieve_candidates(questions: List[Question]) -> None:
+    """Search for all questions sharing a law filter and `n_results` at once."""
+    groups: Dict[tuple, List[Question]] = defaultdict(list)
+    for q in questions:
+        groups[(tuple(sorted(q.laws or [])), q.n_results)].append(q)
+    for (laws, n_results), group in groups.items():
+        start = time.perf_counter()
+        found = get_retriever().search(
+            [q.embedding for q in group],
+            n_results * HYBRID_CANDIDATE_FACTOR,
+            set_law_filter(list(laws)),
+        )
+        elapsed = (time.perf_counter() - start) / len(group)
+        for q, candidates in zip(group, found):
+            q.candidates, q.retrieval_time = candidates, elapsed
+        logger.info(f"Retrieved chunks for {len(group)} questions on {laws or 'all'}.")
+
+
+def answer_question(q: Question, model: str) -> dict:
+    start = time.perf_counter()
+    sources = []
+    try:
+        rag_prompt, query_embedding, cache_key = prepare_rag_query(
+            q.question,
+            model,
+            q.n_results,
+            q.laws,
+            query_embedding=q.embedding,
+            candidates=q.candidates,
+        )
+        if isinstance(rag_prompt, str):
+            answer = rag_prompt
+        else:
+            sources = rag_prompt.sources
+            answer = answer_rag_prompt(
+                q.question, model, q.laws, rag_prompt, query_embedding, cache_key
+            )
+        error = None
+    except Exception as e:
+        logger.error(f"Failed to answer question {q.id}: {e}")
+        answer, error = None, str(e)
+    return {
+        "id": q.id,
+        "question": q.question,
+        "laws": q.laws,
+        "n_results": q.n_results,
+        "model": model,
+        "answer": answer,
+        "sources": sources,
+        "error": error,
+        "timings": {
+            "embedding": round(q.embedding_time, 4),
+            "retrieval": round(q.retrieval_time, 4),
+            "answer": round(time.perf_counter() - start, 4),
+        },
+    }
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    model: str = BASE_CHAT_MODEL,
+    n_results: int = 3,
+    max_workers: int = BATCH_QA_MAX_WORKERS,
+) -> int:
+    """Answer all questions in `input_path`, writing results in input order.
+    LLM calls run concurrently, the shared rate limiter keeps them within the limits.
+    Returns the number of failed questions.
+    """
+    start = time.perf_counter()
+    questions = read_questions(input_path, n_results)
+    embed_questions(questions)
+    retrieve_candidates(questions)
+    failed = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda q: answer_question(q, model), questions)
+            for result in results:
+                failed += result["error"] is not None
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    logger.info(
+        f"Answered {len(questions) - failed} of {len(questions)} questions "
+        f"in {time.perf_counter() - start:.1f}s."
+    )
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input", help="JSONL file with questions")
+    parser.add_argument("output", help="JSONL file to write answers to")
+    parser.add_argument("--model", default=BASE_CHAT_MODEL)
+    parser.add_argument(
+        "--n-results", type=int, default=3, help="default number of chunks"
+    )
+    parser.add_argument("--max-workers", type=int, default=BATCH_QA_MAX_WORKERS)
+    args = parser.parse_args()
+    run_batch(args.input, args.output, args.model, args.n_results, args.max_workers)
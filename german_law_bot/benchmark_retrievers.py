@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Compare the latency of the Chroma and NumPy retrievers on the loaded laws.
+Queries are perturbed copies of stored embeddings, so no API calls are made.
+"""
+import argparse
+import logging
+import time
+
+from typing import List
+
+import numpy as np
+
+from qa import set_law_filter
+from retrievers import (
+    RETRIEVERS,
+    get_retriever,
+)
+from vector_store import get_collection
+
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+def sample_queries(n_queries: int, noise: float = 0.01, seed: int = 0) -> np.ndarray:
+    stored = get_collection().get(include=["embeddings"])
+    embeddings = np.asarray(stored["embeddings"], dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.integers(len(embeddings), size=n_queries)]
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def benchmark(
+    name: str, queries: np.ndarray, n: int, where: dict, batch_size: int
+) -> tuple[float, float, List[List[str]]]:
+    """Return the mean latency per query, searched one by one and in batches, in ms."""
+    retriever = get_retriever(name)
+    retriever.search(queries[:1].tolist(), n, where)
+    start = time.perf_counter()
+    ids = [retriever.search([q.tolist()], n, where)[0] for q in queries]
+    single = (time.perf_counter() - start) / len(queries) * 1000
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        retriever.search(queries[i : i + batch_size].tolist(), n, where)
+    batched = (time.perf_counter() - start) / len(queries) * 1000
+    return single, batched, [[hit[0] for hit in hits] for hits in ids]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n", type=int, default=10, help="results per query")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--laws", nargs="*", help="restrict the search to these laws")
+    args = parser.parse_args()
+    queries = sample_queries(args.queries)
+    where = set_law_filter(args.laws)
+    print(f"{get_collection().count()} chunks, {args.queries} queries, n={args.n}")
+    results = {}
+    for name in RETRIEVERS:
+        single, batched, results[name] = benchmark(
+            name, queries, args.n, where, args.batch_size
+        )
+        print(f"{name:>8}: {single:8.3f} ms/query, {batched:8.3f} ms/query batched")
+    # NOTE: the NumPy search is exact, i.e., this is the recall of Chroma's HNSW index
+    recall = np.mean(
+        [
+            len(set(c) & set(e)) / max(len(e), 1)
+            for c, e in zip(results["chroma"], results["numpy"])
+        ]
+    )
+    print(f"Recall@{args.n} of chroma against exact search: {recall:.3f}")
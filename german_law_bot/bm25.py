@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Local BM25 keyword index over the ingested chunks, with German-aware tokenization"""
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+
+from collections import (
+    Counter,
+    defaultdict,
+)
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Set,
+    Tuple,
+)
+
+from constants import (
+    BM25_B,
+    BM25_INDEX,
+    BM25_K1,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# fmt: off
+STOPWORDS = {
+    "aber", "alle", "als", "am", "an", "auch", "auf", "aus", "bei", "bis", "da",
+    "damit", "dann", "das", "dass", "dem", "den", "der", "des", "die", "dies",
+    "diese", "dieser", "dieses", "doch", "durch", "ein", "eine", "einem", "einen",
+    "einer", "eines", "er", "es", "für", "gilt", "hat", "ich", "ihr", "im", "in",
+    "ist", "jede", "jeder", "kann", "kein", "keine", "mit", "nach", "nicht", "noch",
+    "nur", "ob", "oder", "sich", "sie", "sind", "so", "soweit", "über", "um", "und",
+    "unter", "vom", "von", "vor", "was", "wenn", "werden", "wie", "wird", "wo",
+    "zu", "zum", "zur",
+}
+# fmt: on
+SUFFIXES = ("ern", "em", "en", "er", "es", "e", "n", "s")
+LINKING_ELEMENTS = ("es", "s", "en", "n", "")
+MIN_STEM = 4
+MIN_COMPOUND = 8
+
+
+def stem(token: str) -> str:
+    """Strip a common inflectional suffix, a lightweight stand-in for a full stemmer."""
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+            return token[: -len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower().replace("ß", "ss")
+    return [
+        stem(t)
+        for t in re.findall(r"[a-zäöü0-9]+", text)
+        if len(t) > 1 and t not in STOPWORDS
+    ]
+
+
+def split_compound(token: str, vocabulary: Set[str]) -> List[str]:
+    """Split a compound into known parts, e.g., `widerrufsfrist` into `widerruf`
+    and `frist`, allowing for linking elements such as the `s` in between.
+    Heads are split recursively, so compounds of more than two parts work as well.
+    """
+    if len(token) < MIN_COMPOUND:
+        return []
+    for i in range(len(token) - MIN_STEM, MIN_STEM - 1, -1):
+        head, tail = token[:i], token[i:]
+        if tail not in vocabulary and stem(tail) not in vocabulary:
+            continue
+        tail = tail if tail in vocabulary else stem(tail)
+        for link in LINKING_ELEMENTS:
+            if link and not head.endswith(link):
+                continue
+            left = head[: len(head) - len(link)]
+            if len(left) < MIN_STEM:
+                continue
+            if left in vocabulary:
+                return [left, tail]
+            parts = split_compound(left, vocabulary)
+            if parts:
+                return parts + [tail]
+    return []
+
+
+class BM25Index:
+    def __init__(self, path: str = BM25_INDEX, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.docs: Dict[str, Tuple[str, int]] = {}
+        self.total_length = 0
+        self._mtime = None
+        self._lock = threading.RLock()
+
+    def _expand(self, tokens: List[str]) -> List[str]:
+        vocabulary = self.postings.keys()
+        expanded = list(tokens)
+        for t in tokens:
+            expanded.extend(split_compound(t, vocabulary))
+        return expanded
+
+    def add(self, ids: List[str], documents: List[str], laws: List[str]) -> None:
+        """Add or replace documents."""
+        with self._lock:
+            self.reload_if_changed()
+            self.remove([i for i in ids if i in self.docs])
+            tokenized = [tokenize(d) for d in documents]
+            for tokens in tokenized:
+                for t in tokens:
+                    self.postings.setdefault(t, {})
+            for id_, law, tokens in zip(ids, laws, tokenized):
+                terms = Counter(self._expand(tokens))
+                for t, tf in terms.items():
+                    self.postings[t][id_] = tf
+                self.docs[id_] = (law, len(tokens))
+                self.total_length += len(tokens)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self.reload_if_changed()
+            ids = set(ids) & set(self.docs)
+            for t in list(self.postings):
+                docs = self.postings[t]
+                for id_ in ids & docs.keys():
+                    del docs[id_]
+                if not docs:
+                    del self.postings[t]
+            for id_ in ids:
+                self.total_length -= self.docs.pop(id_)[1]
+
+    def remove_law(self, law: str) -> None:
+        with self._lock:
+            self.reload_if_changed()
+            self.remove([i for i, (law_, _) in self.docs.items() if law_ == law])
+
+    def rebuild(self, ids: List[str], documents: List[str], laws: List[str]) -> None:
+        """Index all stored chunks from scratch, e.g., for a store ingested before
+        the BM25 index existed.
+        """
+        with self._lock:
+            self.postings, self.docs, self.total_length = defaultdict(dict), {}, 0
+            if os.path.exists(self.path):
+                self._mtime = os.path.getmtime(self.path)
+            self.add(ids, documents, laws)
+            self.save()
+
+    def search(
+        self, query: str, n: int, laws: List[str] | None = None
+    ) -> List[Tuple[str, float]]:
+        """Return up to `n` (id, score) pairs, best first."""
+        with self._lock:
+            self.reload_if_changed()
+            if not self.docs:
+                return []
+            n_docs = len(self.docs)
+            avg_length = self.total_length / n_docs
+            scores = defaultdict(float)
+            for t in set(self._expand(tokenize(query))):
+                docs = self.postings.get(t)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for id_, tf in docs.items():
+                    length = self.docs[id_][1]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[id_] += idf * tf * (self.k1 + 1) / (tf + norm)
+            if laws:
+                scores = {i: s for i, s in scores.items() if self.docs[i][0] in laws}
+            return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n]
+
+    def save(self) -> None:
+        with self._lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump((dict(self.postings), self.docs, self.total_length), f)
+            os.replace(tmp, self.path)
+            self._mtime = os.path.getmtime(self.path)
+        logger.info(f"Saved BM25 index with {len(self.docs)} documents.")
+
+    def reload_if_changed(self) -> None:
+        """Pick up changes saved by other processes, e.g., a separate ingestion run."""
+        if not os.path.exists(self.path):
+            return
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return
+        with self._lock, open(self.path, "rb") as f:
+            postings, self.docs, self.total_length = pickle.load(f)
+            self.postings = defaultdict(dict, postings)
+            self._mtime = mtime
+        logger.info(f"Loaded BM25 index with {len(self.docs)} documents.")
+
+
+bm25_index = BM25Index()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Direct lookup of cited paragraphs, e.g., `§ 433 BGB` or `Art. 1 GG`"""
+import logging
+import re
+import threading
+
+from collections import defaultdict
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+)
+
+from vector_store import (
+    collection_version,
+    get_collection,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# NOTE: a letter suffix as in `§ 20a`, but not the start of a word or of `f.`/`ff.`
+_NUMBER = r"\d+(?:\s?[a-z](?![a-zäöüß.]))?"
+_PREFIX = r"(?:§§?|Art\.|Artikel)"
+_DETAIL = rf"(?:\s*(?:Abs\.|Absatz|S\.|Satz|Nr\.|Nummer)\s*{_NUMBER})*"
+_ITEM = rf"{_NUMBER}(?:\s*ff?\.)?{_DETAIL}"
+_SEPARATOR = rf"\s*(?:,|und|u\.|sowie)\s*(?:{_PREFIX}\s*)?"
+CITATION_PATTERN = re.compile(
+    rf"{_PREFIX}\s*(?P<numbers>{_ITEM}(?:{_SEPARATOR}{_ITEM})*)"
+    r"\s*(?:des\s+|der\s+|im\s+)?(?P<law>[A-ZÄÖÜ][\wÄÖÜäöüß-]*)",
+)
+# NOTE: the paragraph number of each item, not the numbers of Absätze or Sätze
+ITEM_NUMBER_PATTERN = re.compile(rf"(?:^|{_SEPARATOR})({_NUMBER})")
+PARAGRAPH_PATTERN = re.compile(rf"(?:§+|Art\.?|Artikel)\s*(?P<number>{_NUMBER})")
+
+
+def normalize_number(number: str) -> str:
+    return number.replace(" ", "").lower()
+
+
+def parse_citations(query: str, known_laws: Iterable[str]) -> List[Tuple[str, str]]:
+    """Extract (law, paragraph number) pairs for citations of known laws."""
+    known = {law.lower() for law in known_laws}
+    citations = []
+    for match in CITATION_PATTERN.finditer(query):
+        law = match.group("law").lower()
+        if law not in known:
+            continue
+        for number in ITEM_NUMBER_PATTERN.findall(match.group("numbers")):
+            citation = (law, normalize_number(number))
+            if citation not in citations:
+                citations.append(citation)
+    return citations
+
+
+class ParagraphIndex:
+    """Maps (law, paragraph number) to chunk IDs, built from the stored metadata
+    and rebuilt whenever the collection changes.
+    """
+
+    def __init__(self):
+        self._index: Dict[Tuple[str, str], List[str]] = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        version = collection_version()
+        if version == self._version:
+            return
+        stored = get_collection().get(include=["metadatas"])
+        index = defaultdict(list)
+        for id_, md in zip(stored["ids"], stored["metadatas"]):
+            if not md.get("law"):
+                continue
+            # NOTE: chunks of merged norms list each of them, e.g., `§ 3, § 4`
+            for match in PARAGRAPH_PATTERN.finditer(md.get("paragraph") or ""):
+                key = (md["law"].lower(), normalize_number(match.group("number")))
+                index[key].append(id_)
+        self._index, self._version = dict(index), version
+        logger.info(f"Indexed {len(self._index)} paragraphs for direct lookup.")
+
+    def lookup(self, query: str, law_filter: List[str] | None = None) -> List[str]:
+        """Return the chunk IDs of all paragraphs cited in `query`."""
+        with self._lock:
+            self._refresh()
+            laws = {law for law, _ in self._index}
+            if law_filter:
+                laws &= {law.lower() for law in law_filter}
+            ids = []
+            for citation in parse_citations(query, laws):
+                ids.extend(self._index.get(citation, []))
+        if ids:
+            logger.info(f"Found cited chunks {ids} in query `{query}`.")
+        return ids
@@ -20,14 +20,83 @@ CHAT_MODELS = {
 
 CONFIG = "config.yaml"
 DOWNLOADS_DIR = "../data/downloads/"
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+SNAPSHOT_DIR = "../data/snapshots/"
+SNAPSHOT_VERSION = 1
+# NOTE: "float16" or "int8", the latter is scaled per row
+SNAPSHOT_DTYPE = "float16"
 CHROMA_DIR = "../data/chroma"
+# NOTE: rewritten on every write to the store, so that other processes notice changes
+STORE_VERSION = "../data/store_version.txt"
 
 COLLECTION_NAME = "laws"
+# NOTE: one collection per code of law, migrate with `python vector_store.py --shard`
+SHARDED_STORE: bool = False
+SHARD_QUERY_WORKERS = 8
+# NOTE: "chroma" or "numpy", the latter searches an in-process copy of the embeddings
+RETRIEVER = "chroma"
+NUMPY_INDEX_DIR = "../data/numpy_index/"
+
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_MAX_BATCH_TOKENS = 100_000
+EMBEDDING_MAX_WORKERS = 4
+INGEST_CHECKPOINT_SIZE = 1_024
+INGEST_MAX_PROCESSES = 4
+INGEST_MAX_PARALLEL_LAWS = 4
+# NOTE: "structured" follows the XML structure, "legacy" splits by character count
+CHUNKER = "structured"
+CHUNK_MAX_TOKENS = 1_500
+CHUNK_MIN_TOKENS = 100
+
+MAP_MAX_WORKERS = 5
+BATCH_QA_MAX_WORKERS = 16
+
+SINGLE_PASS_RAG: bool = True
+# NOTE: prompt budgets, leaving room for the instructions and the answer
+CONTEXT_BUDGET_TOKENS = {
+    "gpt-3.5-turbo": 12_000,
+    "gpt-4": 6_000,
+    "gpt-4-turbo": 24_000,
+    "gpt-4-1106-preview": 24_000,
+}
+DEFAULT_CONTEXT_BUDGET_TOKENS = 6_000
+
+# NOTE: squared L2 between normalized embeddings, i.e., 2 - 2 * cosine similarity;
+# off until calibrated on labelled queries for the embedding model in use
+RELEVANCE_MAX_DISTANCE: float | None = None
+RELEVANCE_MIN_LEXICAL_OVERLAP = 0.0
+# NOTE: off to keep the fused vector and BM25 ranking
+LEXICAL_RERANK: bool = False
+
+HYBRID_RETRIEVAL: bool = True
+HYBRID_CANDIDATE_FACTOR = 3
+RRF_K = 60
+BM25_INDEX = "../data/bm25.pickle"
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+ANSWER_CACHE_SIMILARITY = 0.97
+ANSWER_CACHE_TTL = 24 * 60 * 60
+ANSWER_CACHE_MAX_ENTRIES = 1_000
+
+RETRY_MAX_ATTEMPTS = 6
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+RATE_LIMIT_REQUESTS_PER_MINUTE = 500
+RATE_LIMIT_TOKENS_PER_MINUTE = 300_000
+
+EMBEDDING_CACHE = "../data/embedding_cache.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
 
 OPENAI_EF = embedding_functions.OpenAIEmbeddingFunction(
     api_key=OPENAI_API_KEY, model_name=EMBEDDING_MODEL
 )
 
 AUTO_LAUNCH_BROWSER: bool = True
+FRONTEND_CONCURRENCY_LIMIT = 8
 
-PERSISTENT_HISTORY = "../data/history.db"
+PERSISTENT_HISTORY = "../data/history.sqlite3"
+LEGACY_HISTORY = "../data/history.db"
+HISTORY_PAGE_SIZE = 500
+HISTORY_QUEUE_SIZE = 1_000
+HISTORY_BATCH_SIZE = 100
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Persistent LRU cache for embeddings, keyed by model and text hash"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+from array import array
+from typing import (
+    Dict,
+    List,
+)
+
+from constants import (
+    EMBEDDING_CACHE,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, hash TEXT NOT NULL, embedding BLOB NOT NULL, "
+                "last_used REAL NOT NULL, PRIMARY KEY (model, hash))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, List[float]]:
+        """Look up cached embeddings.
+        Returns a mapping from input position to vector.
+        """
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for h in set(hashes):
+                row = conn.execute(
+                    "SELECT embedding FROM embeddings WHERE model = ? AND hash = ?",
+                    (model, h),
+                ).fetchone()
+                if row:
+                    found[h] = array("f", row[0]).tolist()
+            if found:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(time.time(), model, h) for h in found],
+                )
+                conn.commit()
+            res = {i: found[h] for i, h in enumerate(hashes) if h in found}
+            # NOTE: counted under the lock, lookups run on several embedding threads
+            self.hits += len(res)
+            self.misses += len(texts) - len(res)
+        return res
+
+    def put_many(
+        self, model: str, texts: List[str], embeddings: List[List[float]]
+    ) -> None:
+        now = time.time()
+        rows = [
+            (model, text_hash(t), array("f", e).tobytes(), now)
+            for t, e in zip(texts, embeddings)
+        ]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, embedding, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        excess = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess -= self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN ("
+                "SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            logger.info(f"Evicted {excess} entries from the embedding cache.")
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM embeddings")
+            conn.commit()
+        self.hits, self.misses = 0, 0
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 """Gradio frontend"""
 import logging
-import time
 
 import gradio as gr
 import pandas as pd
@@ -10,6 +9,7 @@ from constants import (
     AUTO_LAUNCH_BROWSER,
     BASE_CHAT_MODEL,
     CHAT_MODELS,
+    FRONTEND_CONCURRENCY_LIMIT,
 )
 from history import retrieve
 from ingest import (
@@ -32,47 +32,41 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-MODEL = CHAT_MODELS[BASE_CHAT_MODEL]
-SB_CONTEXT: str = ""
-SB_QUESTION: str = ""
-
-
-def set_model(model_) -> None:
-    global MODEL
-    MODEL = CHAT_MODELS[model_]
+def set_model(model_: str) -> str:
     logger.info(f"Set model to {model_}")
+    return CHAT_MODELS[model_]
 
 
-def echo(message, history, n_results, law_filter):
-    global MODEL
-    response = rag_query(
-        query=message, n_results=n_results, law_filter=law_filter, model=MODEL
-    )
-    for i, _ in enumerate(response):
-        time.sleep(0.02)
-        yield response[: i + 1]
+def echo(message, history, n_results, law_filter, model):
+    response = ""
+    for token in rag_query(
+        query=message,
+        n_results=n_results,
+        law_filter=law_filter,
+        model=model,
+        stream=True,
+    ):
+        response += token
+        yield response
 
 
-def gen_question_sb(context, n_results, law_filter):
+def gen_question_sb(context, n_results, law_filter, model) -> tuple[str, str, str]:
     logger.info(f"Generating question for context {context}")
-    global MODEL, SB_CONTEXT, SB_QUESTION
     background, response = generate_question(
-        context=context, n_results=n_results, law_filter=law_filter, model=MODEL
+        context=context, n_results=n_results, law_filter=law_filter, model=model
     )
-    SB_CONTEXT, SB_QUESTION = background, response
-    return response
+    return response, background, response
 
 
-def rate_response_sb(topic, response):
-    global MODEL, SB_CONTEXT, SB_QUESTION
+def rate_response_sb(topic, response, model, sb_context, sb_question) -> str:
     response = assess_answer(
         topic=topic,
-        question=SB_QUESTION,
-        background=SB_CONTEXT,
+        question=sb_question,
+        background=sb_context,
         response=response,
-        model=MODEL,
+        model=model,
     )
-    response += "\n\nQUELLE:\n\n" + SB_CONTEXT
+    response += "\n\nQUELLE:\n\n" + sb_context
     return response
 
 
@@ -133,6 +127,11 @@ def retrieve_history(hist_filter: str) -> dict:
 with gr.Blocks() as demo:
     gr.Markdown("# 🧑‍⚖🧞 German law bot")
 
+    # NOTE: per-session state, so that concurrent users do not share settings
+    model_state = gr.State(CHAT_MODELS[BASE_CHAT_MODEL])
+    sb_context_state = gr.State("")
+    sb_question_state = gr.State("")
+
     with gr.Tab("Einstellungen"):
         gr.Markdown("## Informationen und Einstellungen")
 
@@ -220,7 +219,9 @@ with gr.Blocks() as demo:
             additional_inputs=[
                 n_results_,
                 law_filter_,
+                model_state,
             ],
+            concurrency_limit=FRONTEND_CONCURRENCY_LIMIT,
         )
 
     with gr.Tab("Study buddy"):
@@ -297,6 +298,7 @@ with gr.Blocks() as demo:
     set_model_radio.change(
         fn=set_model,
         inputs=[set_model_radio],
+        outputs=[model_state],
     )
     load_btn.click(
         fn=add_to_db,
@@ -310,11 +312,13 @@ with gr.Blocks() as demo:
     )
     generate_btn_sb.click(
         fn=gen_question_sb,
-        inputs=[content_sb, n_results_sb, law_filter_sb],
-        outputs=[question_sb],
+        inputs=[content_sb, n_results_sb, law_filter_sb, model_state],
+        outputs=[question_sb, sb_context_state, sb_question_state],
+        concurrency_limit=FRONTEND_CONCURRENCY_LIMIT,
     )
     show_hint_btn_sb.click(
-        fn=lambda value: gr.Textbox.update(value=SB_CONTEXT, visible=True),
+        fn=lambda sb_context: gr.Textbox.update(value=sb_context, visible=True),
+        inputs=[sb_context_state],
         outputs=[hint_sb],
     )
     hide_hint_btn_sb.click(
@@ -323,8 +327,9 @@ with gr.Blocks() as demo:
     )
     submit_btn_sb.click(
         fn=rate_response_sb,
-        inputs=[content_sb, input_sb],
+        inputs=[content_sb, input_sb, model_state, sb_context_state, sb_question_state],
         outputs=[solution_sb],
+        concurrency_limit=FRONTEND_CONCURRENCY_LIMIT,
     )
     history_filter_radio.change(
         fn=retrieve_history,
@@ -1,14 +1,30 @@
 #!/usr/bin/env python3
 """Module for keeping track of interactions"""
 
+import atexit
+import dbm
+import json
 import logging
 import os
+import queue
 import shelve
+import sqlite3
+import threading
+import time
 
-from dataclasses import dataclass
+from dataclasses import (
+    asdict,
+    dataclass,
+)
 from typing import Optional
 
-from constants import PERSISTENT_HISTORY
+from constants import (
+    HISTORY_BATCH_SIZE,
+    HISTORY_PAGE_SIZE,
+    HISTORY_QUEUE_SIZE,
+    LEGACY_HISTORY,
+    PERSISTENT_HISTORY,
+)
 
 
 logging.basicConfig(level=logging.INFO)
@@ -35,29 +51,254 @@ class StudyBuddyEntry:
     assessment: Optional[bool] = None
 
 
+ENTRY_TYPES = {
+    "studybuddy": StudyBuddyEntry,
+    "qabot": QuestionAnswerEntry,
+}
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(PERSISTENT_HISTORY, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA foreign_keys=ON")
+        _conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entry_type TEXT NOT NULL,
+                model TEXT NOT NULL,
+                created REAL NOT NULL,
+                entry TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_history_type_created
+                ON history (entry_type, created);
+            CREATE INDEX IF NOT EXISTS idx_history_type_model_created
+                ON history (entry_type, model, created);
+            CREATE TABLE IF NOT EXISTS history_laws (
+                entry_id INTEGER NOT NULL REFERENCES history (id) ON DELETE CASCADE,
+                law TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_history_laws
+                ON history_laws (law, entry_id);
+            """
+        )
+        _conn.commit()
+        if _conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 0:
+            _migrate_from_shelve(_conn)
+    return _conn
+
+
+def _entry_type(entry: StudyBuddyEntry | QuestionAnswerEntry) -> str:
+    for entry_type, cls in ENTRY_TYPES.items():
+        if isinstance(entry, cls):
+            return entry_type
+    raise TypeError(f"Unexpected input {type(entry)}.")
+
+
+def _insert(
+    conn: sqlite3.Connection,
+    entry: StudyBuddyEntry | QuestionAnswerEntry,
+    created: float,
+) -> None:
+    cursor = conn.execute(
+        "INSERT INTO history (entry_type, model, created, entry) VALUES (?, ?, ?, ?)",
+        (_entry_type(entry), entry.model, created, json.dumps(asdict(entry))),
+    )
+    laws = getattr(entry, "laws", None) or []
+    conn.executemany(
+        "INSERT INTO history_laws (entry_id, law) VALUES (?, ?)",
+        [(cursor.lastrowid, law) for law in laws],
+    )
+
+
+def _migrate_from_shelve(conn: sqlite3.Connection, path: str = LEGACY_HISTORY) -> int:
+    """Copy entries from the shelve-based history used by earlier versions."""
+    if not dbm.whichdb(path):
+        return 0
+    # NOTE: the shelve did not record timestamps, keep the entries' order instead
+    created = os.path.getmtime(path) if os.path.exists(path) else time.time()
+    migrated = 0
+    with shelve.open(path, flag="r") as db:
+        for entry_type in ENTRY_TYPES:
+            for entry in db.get(entry_type, []):
+                _insert(conn, entry, created)
+                migrated += 1
+    conn.commit()
+    logger.info(f"Migrated {migrated} history entries from {path}.")
+    return migrated
+
+
+def _write(entries: list[tuple[StudyBuddyEntry | QuestionAnswerEntry, float]]) -> None:
+    with _lock:
+        conn = _connect()
+        with conn:
+            for entry, created in entries:
+                _insert(conn, entry, created)
+
+
+class HistoryWriter:
+    """Writes entries on a background thread, batching queued entries into one
+    transaction. Entries are dropped, and counted, if the queue is full.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = HISTORY_QUEUE_SIZE,
+        batch_size: int = HISTORY_BATCH_SIZE,
+    ):
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # NOTE: counters are updated from request threads and the writer thread
+        self._stats_lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="history-writer", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, entry: StudyBuddyEntry | QuestionAnswerEntry) -> None:
+        self._start()
+        try:
+            self._queue.put_nowait((entry, time.time()))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            logger.warning(f"History queue is full, dropped entry {entry}.")
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                _write(batch)
+                with self._stats_lock:
+                    self.written += len(batch)
+            except Exception as e:
+                with self._stats_lock:
+                    self.dropped += len(batch)
+                logger.error(f"Failed to write {len(batch)} history entries: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self) -> None:
+        """Block until all queued entries are written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+            }
+
+
+writer = HistoryWriter()
+atexit.register(writer.flush)
+
+
 def store(entry: StudyBuddyEntry | QuestionAnswerEntry) -> None:
-    if isinstance(entry, StudyBuddyEntry):
-        entry_type = "studybuddy"
-    elif isinstance(entry, QuestionAnswerEntry):
-        entry_type = "qabot"
-    else:
-        raise TypeError(f"Unexpected input {type(entry)}.")
+    """Queue an entry for writing, without blocking the caller on disk I/O."""
+    entry_type = _entry_type(entry)
     logging.info(f"Storing entry {entry} of type {entry_type}.")
-    with shelve.open(PERSISTENT_HISTORY, writeback=True) as db:
-        if entry_type not in db:
-            db[entry_type] = [entry]
-        else:
-            db[entry_type].append(entry)
+    writer.submit(entry)
+
+
+def _where(
+    entry_type: str,
+    model: str | None,
+    law: str | None,
+    since: float | None,
+    until: float | None,
+) -> tuple[str, list]:
+    clauses, params = ["entry_type = ?"], [entry_type]
+    if model:
+        clauses.append("model = ?")
+        params.append(model)
+    if law:
+        clauses.append("id IN (SELECT entry_id FROM history_laws WHERE law = ?)")
+        params.append(law)
+    if since is not None:
+        clauses.append("created >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("created < ?")
+        params.append(until)
+    return " AND ".join(clauses), params
+
+
+def retrieve(
+    entry_type: str = "studybuddy",
+    model: str | None = None,
+    law: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+    limit: int = HISTORY_PAGE_SIZE,
+    offset: int = 0,
+) -> list[StudyBuddyEntry | QuestionAnswerEntry]:
+    """Return a page of entries, newest first.
+    Entries can be filtered by model, law, and a time range given as UNIX timestamps.
+    """
+    if entry_type not in ENTRY_TYPES:
+        logger.warning(f"Invalid key {entry_type} for looking up history.")
+        return []
+    where, params = _where(entry_type, model, law, since, until)
+    with _lock:
+        rows = (
+            _connect()
+            .execute(
+                f"SELECT entry FROM history WHERE {where} "
+                "ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            )
+            .fetchall()
+        )
+    return [ENTRY_TYPES[entry_type](**json.loads(row[0])) for row in rows]
 
 
-def retrieve(entry_type: str = "studybuddy"):
-    with shelve.open(PERSISTENT_HISTORY) as db:
-        if entry_type not in db:
-            logger.warning(f"Invalid key {entry_type} for looking up history.")
-            return []
-        return db[entry_type]
+def count(
+    entry_type: str = "studybuddy",
+    model: str | None = None,
+    law: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+) -> int:
+    where, params = _where(entry_type, model, law, since, until)
+    with _lock:
+        return (
+            _connect()
+            .execute(f"SELECT COUNT(*) FROM history WHERE {where}", params)
+            .fetchone()[0]
+        )
 
 
 def reset() -> None:
-    """Deletes entire history. Use with CAUTION."""
-    os.remove(PERSISTENT_HISTORY)
+    """Deletes entire history, including the legacy shelve. Use with CAUTION."""
+    global _conn
+    writer.flush()
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        for path in (PERSISTENT_HISTORY, LEGACY_HISTORY):
+            for suffix in ("", "-wal", "-shm", ".db", ".dat", ".dir", ".bak"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
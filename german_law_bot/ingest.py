@@ -1,46 +1,134 @@
 #!/usr/bin/env python3
 """Retrieve laws, load into vector store."""
+import argparse
+import hashlib
 import logging
 import os
+import re
+import tempfile
+import threading
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
     List,
 )
 from dataclasses import dataclass
 
-import chromadb
 import xml.etree.ElementTree as ET
 
-from urllib.request import urlopen
-from io import BytesIO
+from urllib.error import HTTPError
+from urllib.request import (
+    Request,
+    urlopen,
+)
 from zipfile import ZipFile
 
 from constants import (
-    CHROMA_DIR,
-    COLLECTION_NAME,
+    CHUNK_MAX_TOKENS,
+    CHUNK_MIN_TOKENS,
+    CHUNKER,
+    DOWNLOAD_CHUNK_SIZE,
     DOWNLOADS_DIR,
-    OPENAI_EF,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_BATCH_TOKENS,
+    EMBEDDING_MAX_WORKERS,
+    INGEST_CHECKPOINT_SIZE,
+    SNAPSHOT_DIR,
+    SNAPSHOT_DTYPE,
+)
+from bm25 import bm25_index
+from embedding_cache import text_hash
+from snapshot import (
+    export_snapshot,
+    import_snapshot,
 )
 from utils import (
-    get_embedding,
+    estimate_tokens,
+    get_embeddings,
     load_settings,
     save_settings,
 )
+from vector_store import (
+    get_collection,
+    mark_modified,
+    write_lock,
+)
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def download_and_unzip(url: str, destination: str) -> str:
-    http_response = urlopen(url)
-    zipfile = ZipFile(BytesIO(http_response.read()))
-    zipfile.extractall(path=destination)
+# NOTE: guards config.yaml when several laws are ingested concurrently
+config_lock = threading.RLock()
+# NOTE: shared by all laws, bounds the embedding requests in flight across them
+embedding_executor = ThreadPoolExecutor(
+    max_workers=EMBEDDING_MAX_WORKERS, thread_name_prefix="embedding"
+)
+
+
+@dataclass
+class Download:
+    filename: str | None
+    changed: bool
+    etag: str | None = None
+    last_modified: str | None = None
+    sha256: str | None = None
+
+
+def download_and_unzip(
+    url: str,
+    destination: str,
+    etag: str | None = None,
+    last_modified: str | None = None,
+    sha256: str | None = None,
+) -> Download:
+    """Stream the zip to a temporary file and extract it.
+    The request is conditional if `etag` or `last_modified` of an earlier download are
+    given. Nothing is extracted if the server answers 304 or the zip's checksum equals
+    `sha256`, in which case the download is marked as unchanged.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        http_response = urlopen(Request(url, headers=headers))
+    except HTTPError as e:
+        if e.code != 304:
+            raise
+        logger.info(f"{url} not modified since the last download.")
+        return Download(None, False, etag, last_modified, sha256)
+    os.makedirs(destination, exist_ok=True)
+    checksum = hashlib.sha256()
+    with http_response, tempfile.NamedTemporaryFile(
+        dir=destination, suffix=".zip", delete=False
+    ) as tmp:
+        while block := http_response.read(DOWNLOAD_CHUNK_SIZE):
+            checksum.update(block)
+            tmp.write(block)
+        etag = http_response.headers.get("ETag")
+        last_modified = http_response.headers.get("Last-Modified")
+    try:
+        if checksum.hexdigest() == sha256:
+            logger.info(f"{url} has not changed since the last download.")
+            return Download(None, False, etag, last_modified, sha256)
+        with ZipFile(tmp.name) as zipfile:
+            zipfile.extractall(path=destination)
+            files_ = [f for f in zipfile.namelist() if f.endswith(".xml")]
+    finally:
+        os.remove(tmp.name)
     logger.info("Download done.")
-    files_ = [f for f in zipfile.namelist() if f.endswith(".xml")]
     print(files_)
     assert len(files_) == 1, "Download does not contain exactly one XML."
-    return files_[0]
+    return Download(files_[0], True, etag, last_modified, checksum.hexdigest())
 
 
 @dataclass
@@ -52,161 +140,594 @@ class Paragraph:
     footnotes: str
     version_info: str
     embedding: List[float] = None
+    units: List[str] = None
+    section: str = None
 
+    @property
+    def chunk_id(self) -> str:
+        return self.law + self.par.replace("§", "").replace(" ", "_")
 
-def extract_xml(source_dir: str, source_file: str) -> List[Paragraph]:
-    # TODO: possibly combine sub-laws into one chunk
+    @property
+    def document(self) -> str:
+        return self.title + "\n\n" + self.text
+
+    @property
+    def content_hash(self) -> str:
+        return text_hash(self.document)
+
+
+def extract_xml(source_dir: str, source_file: str) -> Iterator[Paragraph]:
+    """Stream the norms of a law as paragraphs.
+    Norms are cleared once processed, so memory stays flat for large codes of law.
+    """
     f = os.path.join(source_dir, source_file)
-    res = []
-    tree = ET.parse(f)
-    root = tree.getroot()
-    version_info = tree.findall(".//standkommentar")
-    version_info = " ".join([vi.text for vi in version_info])
-    logger.info(f"Version info for {source_file}: {version_info}")
-    for norm in root:
-        valid = True
-        law, par, title, text, footnotes = None, None, None, None, None
-        for child in norm:
-            subtags = [c.tag for c in child]
-            if child.tag == "metadaten":
-                if all(t in subtags for t in ("jurabk", "enbez", "titel")):
-                    for md in child:
-                        if md.tag == "jurabk":
-                            law = md.text
-                        if md.tag == "enbez":
-                            par = md.text
-                        if md.tag == "titel":
-                            title = " ".join(list(md.itertext()))
-                else:
-                    valid = False
-            if child.tag == "textdaten":
-                if "text" in subtags:
-                    for cont in child:
-                        if cont.tag == "text":
-                            text = " ".join(list(cont.itertext()))
-                        if cont.tag == "fussnoten":
-                            footnotes = " ".join(list(cont.itertext()))
-                else:
-                    valid = False
-            if not title and not text:
+    version_info = []
+    section = None
+    count = 0
+    context = ET.iterparse(f, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event != "end":
+            continue
+        if elem.tag == "standkommentar" and elem.text:
+            version_info.append(elem.text)
+        elif elem.tag == "norm":
+            heading = elem.find("metadaten/gliederungseinheit")
+            if heading is not None:
+                section = " ".join(
+                    heading.findtext(tag, "").strip()
+                    for tag in ("gliederungsbez", "gliederungstitel")
+                ).strip()
+            par = parse_norm(elem, version_info=" ".join(version_info))
+            root.clear()
+            if par:
+                par.section = section
+                count += 1
+                yield par
+    logger.info(f"Version info for {source_file}: {' '.join(version_info)}")
+    logger.info(f"Extracted {count} (sub)paragraphs from {source_file}.")
+
+
+def parse_norm(norm: ET.Element, version_info: str) -> Paragraph | None:
+    # TODO: possibly combine sub-laws into one chunk
+    valid = True
+    law, par, title, text, footnotes = None, None, None, None, None
+    units = None
+    for child in norm:
+        subtags = [c.tag for c in child]
+        if child.tag == "metadaten":
+            if all(t in subtags for t in ("jurabk", "enbez", "titel")):
+                for md in child:
+                    if md.tag == "jurabk":
+                        law = md.text
+                    if md.tag == "enbez":
+                        par = md.text
+                    if md.tag == "titel":
+                        title = " ".join(list(md.itertext()))
+            else:
                 valid = False
-        if valid:
-            par = Paragraph(
-                law=law,
-                par=par,
-                title=title,
-                text=text,
-                version_info=version_info,
-                footnotes=footnotes,
-            )
-            res.append(par)
+        if child.tag == "textdaten":
+            if "text" in subtags:
+                for cont in child:
+                    if cont.tag == "text":
+                        text = " ".join(list(cont.itertext()))
+                        units = [
+                            u
+                            for content in cont.findall("Content")
+                            for block in content
+                            for u in parse_units(block)
+                        ]
+                    if cont.tag == "fussnoten":
+                        footnotes = " ".join(list(cont.itertext()))
+            else:
+                valid = False
+        if not title and not text:
+            valid = False
+    if not valid:
+        return None
+    return Paragraph(
+        law=law,
+        par=par,
+        title=title,
+        text=text,
+        version_info=version_info,
+        footnotes=footnotes,
+        units=units or None,
+    )
+
+
+def parse_units(block: ET.Element) -> List[str]:
+    """Split a block of a norm's text, usually an Absatz, into its leading text and
+    its numbered items (Nummern), e.g., `1. erster Fall,`.
+    """
+    units, buffer = [], [block.text or ""]
+    for child in block:
+        if child.tag == "DL":
+            units.append(" ".join(buffer))
+            buffer, label = [], ""
+            for item in child:
+                if item.tag == "DT":
+                    label = " ".join(item.itertext())
+                elif item.tag == "DD":
+                    units.append(label + " " + " ".join(item.itertext()))
         else:
-            continue
-    logger.info(f"Extracted {len(res)} (sub)paragraphs from {source_file}.")
-    return res
+            buffer.extend(child.itertext())
+        buffer.append(child.tail or "")
+    units.append(" ".join(buffer))
+    return [" ".join(u.split()) for u in units if u.strip()]
 
 
 def chunk_paragraphs(
-    parags: List[Paragraph], max_chunk: int = 16_000, overlap: int = 500
-) -> List[Paragraph]:
+    parags: Iterable[Paragraph], max_chunk: int = 16_000, overlap: int = 500
+) -> Iterator[Paragraph]:
     # NOTE: this is a very pragmatic approach to chunking
-    parags_ = []
     for p in parags:
         text_len = len(p.text)
         if text_len < max_chunk:
-            parags_.append(p)
+            yield p
         else:
             parts = text_len // (max_chunk + overlap) + 1
             chunk_length = text_len // parts
             for i in range(parts):
                 chunk_start = i * chunk_length - (i > 0) * overlap
                 chunk_end = (i + 1) * chunk_length + overlap
-                parags_.append(
-                    Paragraph(
-                        law=p.law,
-                        par=p.par + f" Teil {i+1}",
-                        title=p.title + f" Teil {i+1}",
-                        text=p.text[chunk_start:chunk_end],
-                        version_info=p.version_info,
-                        footnotes=p.footnotes,
-                    )
+                yield Paragraph(
+                    law=p.law,
+                    par=p.par + f" Teil {i+1}",
+                    title=p.title + f" Teil {i+1}",
+                    text=p.text[chunk_start:chunk_end],
+                    version_info=p.version_info,
+                    footnotes=p.footnotes,
                 )
             logger.info(
                 f"Split up {p.par} into {parts} parts due to its length of {text_len}."
             )
-    return parags_
+
+
+def split_unit(unit: str, max_tokens: int) -> List[str]:
+    """Split an overlong unit at sentence boundaries, or by length as a last resort."""
+    if estimate_tokens(unit) <= max_tokens:
+        return [unit]
+    max_chars = (max_tokens - 1) * 3
+    parts, current = [], ""
+    for sentence in re.split(r"(?<=[.;:])\s+", unit):
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            parts.append(current)
+            current = ""
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars) + 1 or max_chars
+            parts.append(sentence[:cut].strip())
+            sentence = sentence[cut:]
+        current = (current + " " + sentence).strip()
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_structured(p: Paragraph, max_tokens: int) -> List[Paragraph]:
+    """Split a norm at its Absätze and Nummern into parts of at most `max_tokens`."""
+    budget = max_tokens - estimate_tokens(p.title + " Teil 100\n\n")
+    groups, current = [], []
+    for unit in p.units or [p.text]:
+        for piece in split_unit(unit, budget):
+            if current and estimate_tokens("\n".join(current + [piece])) > budget:
+                groups.append(current)
+                current = []
+            current.append(piece)
+    if current:
+        groups.append(current)
+    if len(groups) == 1:
+        return [p]
+    logger.info(f"Split up {p.par} into {len(groups)} parts along its structure.")
+    return [
+        Paragraph(
+            law=p.law,
+            par=p.par + f" Teil {i+1}",
+            title=p.title + f" Teil {i+1}",
+            text="\n".join(group),
+            version_info=p.version_info,
+            footnotes=p.footnotes,
+            units=group,
+            section=p.section,
+        )
+        for i, group in enumerate(groups)
+    ]
+
+
+def merge_paragraphs(parags: List[Paragraph]) -> Paragraph:
+    """Combine several short neighbouring norms into one chunk."""
+    if len(parags) == 1:
+        return parags[0]
+    return Paragraph(
+        law=parags[0].law,
+        par=", ".join(p.par for p in parags),
+        title="; ".join(p.title for p in parags),
+        text="\n\n".join(p.par + " " + p.text for p in parags),
+        version_info=parags[0].version_info,
+        footnotes=" ".join(p.footnotes for p in parags if p.footnotes) or None,
+        section=parags[0].section,
+    )
+
+
+def chunk_structured(
+    parags: Iterable[Paragraph],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    min_tokens: int = CHUNK_MIN_TOKENS,
+) -> Iterator[Paragraph]:
+    """Chunk norms along the structure of the XML, as an alternative to
+    `chunk_paragraphs`. Long norms are split at Absätze and Nummern, short
+    neighbouring norms in the same Gliederungseinheit are merged until they reach
+    `min_tokens`, and norms whose title and text repeat an earlier one are dropped,
+    e.g., consecutive `(weggefallen)` stubs.
+    """
+    seen = set()
+    pending, pending_tokens = [], 0
+    dropped = 0
+    for p in parags:
+        key = (p.law, p.title, p.text)
+        if key in seen:
+            dropped += 1
+            continue
+        seen.add(key)
+        for part in split_structured(p, max_tokens):
+            tokens = estimate_tokens(part.document)
+            if pending and (
+                tokens >= min_tokens
+                or part.section != pending[0].section
+                or part.law != pending[0].law
+                or pending_tokens + tokens > max_tokens
+            ):
+                yield merge_paragraphs(pending)
+                pending, pending_tokens = [], 0
+            if tokens >= min_tokens:
+                yield part
+                continue
+            pending.append(part)
+            pending_tokens += tokens
+            if pending_tokens >= min_tokens:
+                yield merge_paragraphs(pending)
+                pending, pending_tokens = [], 0
+    if pending:
+        yield merge_paragraphs(pending)
+    if dropped:
+        logger.info(f"Dropped {dropped} duplicate norms.")
+
+
+CHUNKERS = {
+    "legacy": chunk_paragraphs,
+    "structured": chunk_structured,
+}
+
+
+def chunk(parags: Iterable[Paragraph], chunker: str = CHUNKER) -> Iterator[Paragraph]:
+    return CHUNKERS[chunker](parags)
+
+
+def batch_paragraphs(
+    parags: Iterable[Paragraph],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+) -> Iterator[List[Paragraph]]:
+    """Pack paragraphs into batches limited by both count and estimated tokens."""
+    batch, batch_tokens = [], 0
+    for p in parags:
+        tokens = estimate_tokens(p.document)
+        if batch and (
+            len(batch) >= batch_size or batch_tokens + tokens > max_batch_tokens
+        ):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(p)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _embed_batch(batch: List[Paragraph]) -> List[Paragraph]:
+    embeddings = get_embeddings([p.document for p in batch])
+    for p, e in zip(batch, embeddings):
+        p.embedding = e
+    return batch
 
 
 def embed_paragraphs(
-    parags: List[Paragraph],
+    parags: Iterable[Paragraph],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
 ) -> List[Paragraph]:
-    ln = len(parags)
-    for c, p in enumerate(parags):
-        p.embedding = get_embedding(p.title + "\n\n" + p.text)
-        logger.info(f"Embedding {c}/{ln}: {p}")
-    return parags
+    """Embed paragraphs in batched requests, several batches in flight at once.
+    All calls share one embedding pool, so laws ingested in parallel do not multiply
+    the number of concurrent requests.
+    Batches are submitted while `parags` is still being consumed, e.g., while parsing.
+    Identical texts, e.g., repealed norms, are embedded once and their embedding is
+    shared by all of them. The returned list keeps the order of the input.
+    """
+    res = []
+    distinct: Dict[str, Paragraph] = {}
+    totals, uniques = defaultdict(int), defaultdict(int)
+
+    def first_occurrences() -> Iterator[Paragraph]:
+        for p in parags:
+            res.append(p)
+            totals[p.law] += 1
+            if p.content_hash not in distinct:
+                distinct[p.content_hash] = p
+                uniques[p.law] += 1
+                yield p
+
+    embedded = 0
+    batches = batch_paragraphs(first_occurrences(), batch_size, max_batch_tokens)
+    for batch in embedding_executor.map(_embed_batch, batches):
+        embedded += len(batch)
+        logger.info(f"Embedded {embedded} paragraphs.")
+    for p in res:
+        p.embedding = distinct[p.content_hash].embedding
+    for law, total in totals.items():
+        logger.info(
+            f"Embedded {uniques[law]} distinct of {total} paragraphs for {law}, "
+            f"{1 - uniques[law] / total:.1%} deduplicated."
+        )
+    return res
 
 
 def load_into_chroma(parags: List[Paragraph]) -> None:
-    chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
-    collection = chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME, embedding_function=OPENAI_EF
-    )
-    collection.add(
-        documents=[p.title + "\n\n" + p.text for p in parags],
-        embeddings=[p.embedding for p in parags],
-        metadatas=[
-            {"law": p.law, "paragraph": p.par, "title": p.title} for p in parags
-        ],
-        ids=[p.law + p.par.replace("§", "").replace(" ", "_") for p in parags],
-    )
+    collection = get_collection()
+    with write_lock:
+        collection.upsert(
+            documents=[p.document for p in parags],
+            embeddings=[p.embedding for p in parags],
+            metadatas=[
+                {
+                    "law": p.law,
+                    "paragraph": p.par,
+                    "title": p.title,
+                    "hash": p.content_hash,
+                    "tokens": estimate_tokens(p.document),
+                    "section": p.section or "",
+                }
+                for p in parags
+            ],
+            ids=[p.chunk_id for p in parags],
+        )
+        mark_modified()
     logger.info(f"Loaded {len(parags)} paragraphs into the vector store.")
 
 
-def delete_from_chroma(law_code: str) -> None:
-    chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
-    collection = chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME, embedding_function=OPENAI_EF
+def store_in_checkpoints(
+    parags: Iterable[Paragraph],
+    checkpoint_size: int = INGEST_CHECKPOINT_SIZE,
+    on_checkpoint: Callable[[int], None] | None = None,
+    skip_stored: bool = False,
+) -> int:
+    """Embed and store paragraphs checkpoint by checkpoint, so that an interrupted run
+    only loses the current checkpoint. With `skip_stored` set, chunks that are already
+    stored with the same content hash are not embedded again, i.e., the run resumes.
+    Returns the number of paragraphs processed.
+    """
+    parags = iter(parags)
+    done, skipped = 0, 0
+    while checkpoint := list(islice(parags, checkpoint_size)):
+        todo = checkpoint
+        if skip_stored:
+            stored = get_collection().get(
+                ids=[p.chunk_id for p in checkpoint], include=["metadatas"]
+            )
+            hashes = {
+                i: md.get("hash") for i, md in zip(stored["ids"], stored["metadatas"])
+            }
+            todo = [p for p in checkpoint if hashes.get(p.chunk_id) != p.content_hash]
+        if todo:
+            load_into_chroma(embed_paragraphs(todo))
+        # NOTE: also covers chunks stored by an interrupted run before the index was
+        # saved
+        bm25_index.add(
+            [p.chunk_id for p in checkpoint],
+            [p.document for p in checkpoint],
+            [p.law for p in checkpoint],
+        )
+        bm25_index.save()
+        done += len(checkpoint)
+        skipped += len(checkpoint) - len(todo)
+        if on_checkpoint:
+            on_checkpoint(done)
+        logger.info(
+            f"Checkpoint: {done} paragraphs stored ({skipped} already present)."
+        )
+    return done
+
+
+def get_stored_hashes(law_codes: Iterable[str]) -> Dict[str, str | None]:
+    collection = get_collection()
+    hashes = {}
+    for law_code in law_codes:
+        stored = collection.get(where={"law": law_code}, include=["metadatas"])
+        for id_, md in zip(stored["ids"], stored["metadatas"]):
+            hashes[id_] = md.get("hash")
+    return hashes
+
+
+def update_in_chroma(
+    law_code: str,
+    parags: Iterable[Paragraph],
+    on_checkpoint: Callable[[int], None] | None = None,
+) -> None:
+    """Incrementally update a law that is already in the vector store.
+    Only new or changed chunks are embedded and upserted, dropped chunks are deleted.
+    """
+    parags = list(parags)
+    stored = get_stored_hashes({law_code} | {p.law for p in parags})
+    changed = [p for p in parags if stored.get(p.chunk_id) != p.content_hash]
+    dropped = list(set(stored) - {p.chunk_id for p in parags})
+    if changed:
+        store_in_checkpoints(changed, on_checkpoint=on_checkpoint)
+    if dropped:
+        with write_lock:
+            get_collection().delete(ids=dropped)
+            mark_modified()
+        bm25_index.remove(dropped)
+        bm25_index.save()
+    logger.info(
+        f"Updated {law_code}: {len(changed)} new or changed, {len(dropped)} dropped, "
+        f"{len(parags) - len(changed)} unchanged paragraphs."
     )
+
+
+def delete_from_chroma(law_code: str) -> None:
+    collection = get_collection()
     del_len = len(collection.get(where={"law": law_code}))
-    collection.delete(where={"law": law_code})
+    with write_lock:
+        collection.delete(where={"law": law_code})
+        mark_modified()
+    bm25_index.remove_law(law_code)
+    bm25_index.save()
     logger.info(f"Deleted {del_len} elements from the vector store for {law_code}.")
 
 
 def get_chroma_stats() -> str:
-    chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
-    collection = chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME, embedding_function=OPENAI_EF
-    )
+    collection = get_collection()
     return "Anzahl an Embeddings im Vector Store: " + str(collection.count())
 
 
 def peek() -> None:
-    chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
-    collection = chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME, embedding_function=OPENAI_EF
-    )
+    collection = get_collection()
     print(collection.peek())
 
 
-def load_from_config() -> None:
-    config = load_settings()
-    for law in config:
-        if config[law]["desired"] is True and config[law]["loaded"] is False:
-            filename = download_and_unzip(
-                url=config[law]["link"], destination=DOWNLOADS_DIR
-            )
-            parags = extract_xml(source_dir=DOWNLOADS_DIR, source_file=filename)
-            chunked_parags = chunk_paragraphs(parags)
-            embedded_parags = embed_paragraphs(chunked_parags)
-            logger.info(f"Retrieved {law}.")
-            load_into_chroma(embedded_parags)
-            logger.info(f"Loaded {law} into vector store.")
+def laws_to_ingest(config: dict, update: bool = False) -> List[str]:
+    return [
+        law
+        for law in config
+        if config[law]["desired"] is True and (config[law]["loaded"] is False or update)
+    ]
+
+
+def download_validators(law_config: dict) -> Dict[str, str | None]:
+    """Values of the last download for conditional requests, for loaded laws only."""
+    if law_config["loaded"] is not True:
+        return {}
+    return {k: law_config.get(k) for k in ("etag", "last_modified", "sha256")}
+
+
+def remember_download(law: str, config: dict, download: Download) -> None:
+    with config_lock:
+        if download.filename:
+            config[law]["file"] = download.filename
+        config[law]["etag"] = download.etag
+        config[law]["last_modified"] = download.last_modified
+        config[law]["sha256"] = download.sha256
+        save_settings(config)
+
+
+def fetch_law(link: str, **validators) -> tuple[Download, List[Paragraph]]:
+    """Download, parse and chunk a law, e.g., in a worker process.
+    No paragraphs are returned if the law has not changed since the last download.
+    """
+    download = download_and_unzip(url=link, destination=DOWNLOADS_DIR, **validators)
+    if not download.changed:
+        return download, []
+    parags = extract_xml(source_dir=DOWNLOADS_DIR, source_file=download.filename)
+    return download, list(chunk(parags))
+
+
+def ingest_law(
+    law: str,
+    config: dict,
+    download: Download,
+    parags: Iterable[Paragraph],
+    on_checkpoint: Callable[[int], None] | None = None,
+) -> None:
+    """Load a law into the vector store, or update it if it is loaded already.
+    Its state in `config` is updated and saved along the way.
+    """
+    if config[law]["loaded"] is True:
+        update_in_chroma(law, parags, on_checkpoint=on_checkpoint)
+        logger.info(f"Updated {law} in vector store.")
+    else:
+        resume = config[law].get("progress") is not None
+        if resume:
+            logger.info(f"Resuming {law} after {config[law]['progress']} paragraphs.")
+
+        def save_progress(done: int) -> None:
+            with config_lock:
+                config[law]["progress"] = done
+                save_settings(config)
+            if on_checkpoint:
+                on_checkpoint(done)
+
+        store_in_checkpoints(parags, on_checkpoint=save_progress, skip_stored=resume)
+        logger.info(f"Loaded {law} into vector store.")
+        with config_lock:
             config[law]["loaded"] = True
-            config[law]["file"] = filename
+            config[law].pop("progress", None)
+    # NOTE: only now, so that a failed run downloads the law again
+    remember_download(law, config, download)
+
+
+def mark_snapshot_loaded(law: str) -> None:
+    """Record a law imported from a snapshot as loaded, if it is configured."""
+    with config_lock:
+        config = load_settings()
+        if law in (config or {}):
+            config[law]["loaded"] = True
+            config[law].pop("progress", None)
             save_settings(config)
 
 
+def load_from_config(update: bool = False) -> None:
+    """Load all desired laws that are not loaded yet.
+    With `update` set, also re-download loaded laws and apply changes incrementally.
+    """
+    config = load_settings()
+    for law in laws_to_ingest(config, update):
+        download = download_and_unzip(
+            url=config[law]["link"],
+            destination=DOWNLOADS_DIR,
+            **download_validators(config[law]),
+        )
+        if not download.changed:
+            remember_download(law, config, download)
+            continue
+        parags = extract_xml(source_dir=DOWNLOADS_DIR, source_file=download.filename)
+        ingest_law(law, config, download, chunk(parags))
+
+
 if __name__ == "__main__":
-    load_from_config()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="re-download loaded laws and only re-embed changed paragraphs",
+    )
+    parser.add_argument(
+        "--export",
+        nargs="+",
+        metavar="LAW",
+        help="write snapshots of loaded laws instead of ingesting",
+    )
+    parser.add_argument(
+        "--import",
+        dest="import_",
+        nargs="+",
+        metavar="LAW",
+        help="load laws from snapshots instead of downloading and embedding them",
+    )
+    parser.add_argument(
+        "--snapshot-dir", default=SNAPSHOT_DIR, help="directory of the snapshots"
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["float16", "int8"],
+        default=SNAPSHOT_DTYPE,
+        help="precision of exported embeddings",
+    )
+    args = parser.parse_args()
+    if args.export:
+        for law in args.export:
+            export_snapshot(law, args.snapshot_dir, args.dtype)
+    elif args.import_:
+        for law in args.import_:
+            import_snapshot(law, args.snapshot_dir)
+            mark_snapshot_loaded(law)
+    else:
+        load_from_config(update=args.update)
     peek()
@@ -4,25 +4,39 @@ from __future__ import annotations
 
 import logging
 import random
+import re
 
-import chromadb
-from openai import (
-    OpenAI,
-    APIError,
-    RateLimitError,
-    InternalServerError,
-)
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from openai import OpenAI
 
 from typing import (
+    Iterator,
     List,
     Dict,
 )
 
+from answer_cache import AnswerCache
+from bm25 import (
+    bm25_index,
+    tokenize,
+)
+from citations import ParagraphIndex
 from constants import (
     BASE_CHAT_MODEL,
-    CHROMA_DIR,
-    COLLECTION_NAME,
-    OPENAI_EF,
+    CONTEXT_BUDGET_TOKENS,
+    DEFAULT_CONTEXT_BUDGET_TOKENS,
+    HYBRID_CANDIDATE_FACTOR,
+    HYBRID_RETRIEVAL,
+    LEXICAL_RERANK,
+    MAP_MAX_WORKERS,
+    RELEVANCE_MAX_DISTANCE,
+    RELEVANCE_MIN_LEXICAL_OVERLAP,
+    RRF_K,
+    SINGLE_PASS_RAG,
 )
 from history import (
     store,
@@ -37,37 +51,247 @@ from prompts.prompt_qa import (
     PROMPT_SB_ASSESS_ANSWER,
     PROMPT_SB_EXTRACT_ASSESSMENT,
 )
-from utils import get_embedding
+from rate_limit import (
+    call_with_retries,
+    limiter,
+)
+from retrievers import get_retriever
+from utils import (
+    estimate_tokens,
+    get_embedding,
+)
+from vector_store import (
+    collection_version,
+    get_collection,
+    laws_in,
+)
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-oai_client = OpenAI()
+# NOTE: retries are handled by `call_with_retries`
+oai_client = OpenAI(max_retries=0)
+answer_cache = AnswerCache()
+paragraph_index = ParagraphIndex()
 
 
 def retrieve_from_vdb(
     query: str,
     where_filter: dict,
     n: int = 3,
+    query_embedding: List[float] | None = None,
+    pinned_ids: List[str] | None = None,
+    candidates: List[tuple] | None = None,
 ) -> dict:
-    query_embedding = get_embedding(query)
-    chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
-    collection = chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME, embedding_function=OPENAI_EF
-    )
-    relevant_chunks = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n,
-        where=where_filter,
-    )
+    """Retrieve the `n` most relevant chunks.
+    Chunks in `pinned_ids`, e.g., cited paragraphs, come first with a distance of 0,
+    the remaining slots are filled by vector search. If the pinned chunks fill all
+    slots, the query is not embedded at all. Vector search results can be passed as
+    `candidates`, e.g., from a search for several queries at once.
+    """
+    collection = get_collection()
+    pinned_ids = (pinned_ids or [])[:n]
+    ids, documents, metadatas, distances = [], [], [], []
+    if pinned_ids:
+        pinned = collection.get(ids=pinned_ids, include=["documents", "metadatas"])
+        pinned = dict(zip(pinned["ids"], zip(pinned["documents"], pinned["metadatas"])))
+        for id_ in pinned_ids:
+            if id_ in pinned:
+                ids.append(id_)
+                documents.append(pinned[id_][0])
+                metadatas.append(pinned[id_][1])
+                distances.append(0.0)
+    if len(ids) < n:
+        if query_embedding is None:
+            query_embedding = get_embedding(query)
+        if candidates is None:
+            # NOTE: over-fetch so that collapsed duplicates do not leave slots empty
+            n_candidates = n * HYBRID_CANDIDATE_FACTOR
+            candidates = get_retriever().search(
+                [query_embedding], n_candidates, where_filter
+            )[0]
+        if HYBRID_RETRIEVAL:
+            candidates = fuse_with_bm25(
+                query, query_embedding, candidates, laws_in(where_filter)
+            )
+        # NOTE: chunks with identical text, e.g., repealed norms, take one slot only
+        hashes = {md.get("hash") for md in metadatas if md}
+        collapsed = 0
+        for id_, doc, md, dist in candidates:
+            if len(ids) >= n or id_ in ids:
+                continue
+            hash_ = (md or {}).get("hash")
+            if hash_ and hash_ in hashes:
+                collapsed += 1
+                continue
+            hashes.add(hash_)
+            ids.append(id_)
+            documents.append(doc)
+            metadatas.append(md)
+            distances.append(dist)
+        if collapsed:
+            logger.info(f"Collapsed {collapsed} duplicate chunks.")
+    relevant_chunks = {
+        "ids": [ids],
+        "documents": [documents],
+        "metadatas": [metadatas],
+        "distances": [distances],
+    }
     logger.info(
         f"Most relevant chunks for query `{query}` are {relevant_chunks['ids']}"
     )
     return relevant_chunks
 
 
+def fuse_with_bm25(
+    query: str,
+    query_embedding: List[float],
+    candidates: List[tuple],
+    laws: List[str] | None = None,
+) -> List[tuple]:
+    """Merge vector search candidates with BM25 results using reciprocal rank fusion.
+    Candidates are (id, document, metadata, distance) tuples, chunks that were only
+    found by BM25 are fetched with their distance to the query computed locally.
+    """
+    collection = get_collection()
+    bm25_index.reload_if_changed()
+    if not bm25_index.docs and collection.count():
+        logger.info("BM25 index is empty, building it from the vector store.")
+        stored = collection.get(include=["documents", "metadatas"])
+        bm25_index.rebuild(
+            stored["ids"],
+            stored["documents"],
+            [md["law"] for md in stored["metadatas"]],
+        )
+    keyword_ids = [id_ for id_, _ in bm25_index.search(query, len(candidates), laws)]
+    scores = defaultdict(float)
+    for ranking in ([c[0] for c in candidates], keyword_ids):
+        for rank, id_ in enumerate(ranking):
+            scores[id_] += 1 / (RRF_K + rank + 1)
+    by_id = {c[0]: c for c in candidates}
+    missing = [id_ for id_ in keyword_ids if id_ not in by_id]
+    if missing:
+        fetched = collection.get(
+            ids=missing, include=["documents", "metadatas", "embeddings"]
+        )
+        query_vec = np.asarray(query_embedding)
+        for id_, doc, md, emb in zip(
+            fetched["ids"],
+            fetched["documents"],
+            fetched["metadatas"],
+            fetched["embeddings"],
+        ):
+            # NOTE: squared L2, the distance chroma reports by default
+            dist = float(np.sum((np.asarray(emb) - query_vec) ** 2))
+            by_id[id_] = (id_, doc, md, dist)
+    fused = sorted(by_id, key=lambda id_: scores[id_], reverse=True)
+    logger.info(f"Fused vector and BM25 results: {fused}")
+    return [by_id[id_] for id_ in fused]
+
+
+def gate_chunks(
+    query: str,
+    chunks: dict,
+    max_distance: float | None = RELEVANCE_MAX_DISTANCE,
+    lexical_rerank: bool = LEXICAL_RERANK,
+    min_overlap: float = RELEVANCE_MIN_LEXICAL_OVERLAP,
+) -> dict:
+    """Drop or reorder retrieved chunks before they are sent to the LLM.
+    Chunks further than `max_distance` from the query or sharing less than
+    `min_overlap` of the query's terms are dropped, the closest chunk is always kept.
+    With `lexical_rerank` set, the rest is ordered by term overlap with the query.
+    Pinned chunks, i.e., those at distance 0, stay in front and are never dropped.
+    """
+    query_terms = set(tokenize(query))
+    rows = list(
+        zip(
+            chunks["ids"][0],
+            chunks["documents"][0],
+            chunks["metadatas"][0],
+            chunks["distances"][0],
+        )
+    )
+    pinned = [row for row in rows if row[3] == 0.0]
+    rest = [row for row in rows if row[3] != 0.0]
+
+    def overlap(row: tuple) -> float:
+        if not query_terms:
+            return 1.0
+        return len(query_terms & set(tokenize(row[1]))) / len(query_terms)
+
+    kept = [
+        row
+        for row in rest
+        if (max_distance is None or row[3] <= max_distance)
+        and overlap(row) >= min_overlap
+    ]
+    if not kept and not pinned:
+        kept = [min(rest, key=lambda row: row[3])]
+    if lexical_rerank:
+        kept.sort(key=overlap, reverse=True)
+    kept = pinned + kept
+    if len(kept) < len(rows):
+        logger.info(
+            f"Relevance gate skipped {len(rows) - len(kept)} of {len(rows)} map calls: "
+            f"{[row[0] for row in rows if row not in kept]}"
+        )
+    return {
+        "ids": [[row[0] for row in kept]],
+        "documents": [[row[1] for row in kept]],
+        "metadatas": [[row[2] for row in kept]],
+        "distances": [[row[3] for row in kept]],
+    }
+
+
+def compact(text: str) -> str:
+    """Strip editorial notes like `(+++ Textnachweis ab: 1.1.1980 +++)` and
+    redundant whitespace.
+    """
+    text = re.sub(r"\(\+\+\+.*?\+\+\+\)", " ", text, flags=re.DOTALL)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def pack_context(chunks: dict, model: str) -> tuple[str, List[str]] | None:
+    """Pack chunks into a single context within the model's token budget.
+    Pinned chunks, i.e., those at distance 0, go first, the others are added in
+    ranking order until the budget is reached and the rest is dropped. Returns the
+    context and the ids of the packed chunks, or None if the pinned chunks or the
+    top chunk do not fit so that map reduce is used instead.
+    """
+    budget = CONTEXT_BUDGET_TOKENS.get(model, DEFAULT_CONTEXT_BUDGET_TOKENS)
+    rows = sorted(
+        zip(
+            chunks["ids"][0],
+            chunks["documents"][0],
+            chunks["metadatas"][0],
+            chunks["distances"][0],
+        ),
+        key=lambda row: row[3] != 0.0,
+    )
+    parts, packed_ids, used = [], [], 0
+    for id_, doc, md, dist in rows:
+        text = compact(doc)
+        tokens = (md or {}).get("tokens") or estimate_tokens(text)
+        if used + tokens > budget:
+            if dist == 0.0:
+                logger.info(f"Pinned chunks exceed {budget} tokens for {model}.")
+                return None
+            logger.info(
+                f"Context for {model} exceeds {budget} tokens, "
+                f"dropped {[row[0] for row in rows[len(parts):]]}."
+            )
+            break
+        parts.append(id_ + ": " + text)
+        packed_ids.append(id_)
+        used += tokens
+    if not parts:
+        return None
+    logger.info(f"Packed {len(parts)} chunks with ~{used} tokens into one prompt.")
+    return "\n\n".join(parts), packed_ids
+
+
 def validate_vdb_results(chunks: dict) -> str | None:
     if not chunks["ids"][0]:
         logger.error("Retrieval did not return any relevant chunks.")
@@ -83,58 +307,239 @@ def query_llm(
     msgs: List[Dict[str, str]],
     model: str = BASE_CHAT_MODEL,
     temperature: float = 0.0,
-) -> str:
+    stream: bool = False,
+) -> str | Iterator[str]:
+    """Query the chat model.
+    With `stream` set, return a generator yielding the response tokens as they arrive.
+    """
     logger.info(f"Sending query: {msgs}.")
-    response = None
-    while not response:
-        try:
-            response = oai_client.chat.completions.create(
-                model=model,
-                messages=msgs,
-                temperature=temperature,
-            )
-        except APIError as e:
-            logger.error(e)
-        except InternalServerError as e:
-            logger.error(e)
-        except RateLimitError as e:
-            logger.error(e)
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in msgs)
+
+    def create():
+        limiter.acquire(prompt_tokens)
+        return oai_client.chat.completions.create(
+            model=model,
+            messages=msgs,
+            temperature=temperature,
+            stream=stream,
+        )
+
+    response = call_with_retries(create)
+    if stream:
+        return _stream_tokens(response)
     res = response.choices[0].message.content
     logger.info(f"Received response to query: `{res}`.")
     return res
 
 
+def _stream_tokens(response) -> Iterator[str]:
+    tokens = []
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        token = chunk.choices[0].delta.content
+        if token:
+            tokens.append(token)
+            yield token
+    logger.info(f"Received streamed response to query: `{''.join(tokens)}`.")
+
+
+@dataclass
+class RagPrompt:
+    prompt: str
+    context: str
+    sources: List[str]
+    irrelevant_srcs: List[str] | None = None
+
+    def citation(self) -> str:
+        citation = f"\n\nQuelle: {', '.join(self.sources)}"
+        if self.irrelevant_srcs:
+            citation += f" (Auch geprueft: {', '.join(self.irrelevant_srcs)})"
+        return citation
+
+
 def rag_query(
     query: str,
     model: str = BASE_CHAT_MODEL,
     n_results: int = 3,
     law_filter: List[str] = None,
-) -> str:
+    max_workers: int = MAP_MAX_WORKERS,
+    stream: bool = False,
+) -> str | Iterator[str]:
     """Answer query using Retrieval Augmented Generation.
     Use map reduce if the number of chunks to be considered is set to be larger than 1.
+    The map calls run concurrently, at most `max_workers` at a time.
+    With `stream` set, return a generator yielding the final answer token by token.
+    Answers to sufficiently similar earlier queries are served from the answer cache.
+    Paragraphs cited in the query, e.g., `§ 433 BGB`, are looked up directly.
+    """
+    rag_prompt, query_embedding, cache_key = prepare_rag_query(
+        query, model, n_results, law_filter, max_workers
+    )
+    if isinstance(rag_prompt, str):
+        return iter([rag_prompt]) if stream else rag_prompt
+    if stream:
+        return _stream_rag_answer(
+            query, model, law_filter, rag_prompt, query_embedding, cache_key
+        )
+    return answer_rag_prompt(
+        query, model, law_filter, rag_prompt, query_embedding, cache_key
+    )
+
+
+def prepare_rag_query(
+    query: str,
+    model: str = BASE_CHAT_MODEL,
+    n_results: int = 3,
+    law_filter: List[str] = None,
+    max_workers: int = MAP_MAX_WORKERS,
+    query_embedding: List[float] | None = None,
+    candidates: List[tuple] | None = None,
+) -> tuple[RagPrompt | str, List[float] | None, tuple | None]:
+    """Everything in `rag_query` up to the final LLM call.
+    Returns the prompt, or the final answer if it is cached or there is nothing to
+    answer from, together with the query embedding and the answer cache key.
+    """
+    pinned_ids = paragraph_index.lookup(query, law_filter)
+    cache_key = None
+    if len(pinned_ids) < n_results:
+        if query_embedding is None:
+            query_embedding = get_embedding(query)
+        # NOTE: questions citing different paragraphs embed almost identically
+        cache_key = (
+            frozenset(law_filter or []),
+            tuple(pinned_ids),
+            model,
+            n_results,
+            collection_version(),
+        )
+        cached = answer_cache.lookup(query_embedding, cache_key)
+        if cached is not None:
+            return cached, query_embedding, cache_key
+    rag_prompt = build_rag_prompt(
+        query,
+        model,
+        n_results,
+        law_filter,
+        max_workers,
+        query_embedding,
+        pinned_ids,
+        candidates,
+    )
+    return rag_prompt, query_embedding, cache_key
+
+
+def answer_rag_prompt(
+    query: str,
+    model: str,
+    law_filter: List[str] | None,
+    rag_prompt: RagPrompt,
+    query_embedding: List[float] | None,
+    cache_key: tuple | None,
+) -> str:
+    msgs = [{"role": "user", "content": rag_prompt.prompt}]
+    res = query_llm(msgs, model)
+    logger.info(f"Got response: `{res}`.")
+    response = res + rag_prompt.citation()
+    _store_rag_answer(query, model, law_filter, rag_prompt, response)
+    if cache_key:
+        answer_cache.add(query_embedding, cache_key, response)
+    return response
+
+
+def _stream_rag_answer(
+    query: str,
+    model: str,
+    law_filter: List[str] | None,
+    rag_prompt: RagPrompt,
+    query_embedding: List[float] | None,
+    cache_key: tuple | None,
+) -> Iterator[str]:
+    msgs = [{"role": "user", "content": rag_prompt.prompt}]
+    tokens = []
+    for token in query_llm(msgs, model, stream=True):
+        tokens.append(token)
+        yield token
+    citation = rag_prompt.citation()
+    yield citation
+    response = "".join(tokens) + citation
+    _store_rag_answer(query, model, law_filter, rag_prompt, response)
+    if cache_key:
+        answer_cache.add(query_embedding, cache_key, response)
+
+
+def _store_rag_answer(
+    query: str,
+    model: str,
+    law_filter: List[str] | None,
+    rag_prompt: RagPrompt,
+    response: str,
+) -> None:
+    store(
+        QuestionAnswerEntry(
+            model=model,
+            question=query,
+            context_summary=rag_prompt.context,
+            answer=response,
+            laws=law_filter,
+        )
+    )
+
+
+def build_rag_prompt(
+    query: str,
+    model: str = BASE_CHAT_MODEL,
+    n_results: int = 3,
+    law_filter: List[str] = None,
+    max_workers: int = MAP_MAX_WORKERS,
+    query_embedding: List[float] | None = None,
+    pinned_ids: List[str] | None = None,
+    candidates: List[tuple] | None = None,
+) -> RagPrompt | str:
+    """Retrieve context and run the map stage if needed.
+    Returns the final prompt, or a message for the user if there is nothing to answer
+    from.
     """
     law_filter_ = set_law_filter(law_filter)
-    chunks_ = retrieve_from_vdb(query=query, n=n_results, where_filter=law_filter_)
+    chunks_ = retrieve_from_vdb(
+        query=query,
+        n=n_results,
+        where_filter=law_filter_,
+        query_embedding=query_embedding,
+        pinned_ids=pinned_ids,
+        candidates=candidates,
+    )
     invalid_retrieval_msg = validate_vdb_results(chunks_)
     if invalid_retrieval_msg:
         return invalid_retrieval_msg
+    chunks_ = gate_chunks(query, chunks_)
     sources = chunks_["ids"][0]
     irrelevant_srcs = None
-    if n_results == 1:
+    if n_results == 1 or len(sources) == 1:
         context = chunks_["documents"][0][0]
         prompt = PROMPT_RAG.format(context=context, question=query)
+    elif SINGLE_PASS_RAG and (packed := pack_context(chunks_, model)):
+        context, sources = packed
+        prompt = PROMPT_RAG.format(context=context, question=query)
     elif n_results > 1:
         context_ = {}
         irrelevant_srcs = []
-        for i in range(n_results):
-            context_single = chunks_["documents"][0][i]
-            prompt = PROMPT_MAP_REDUCE.format(context=context_single, question=query)
-            msgs = [{"role": "user", "content": prompt}]
-            res = query_llm(msgs, model)
+        map_msgs = [
+            [
+                {
+                    "role": "user",
+                    "content": PROMPT_MAP_REDUCE.format(context=c, question=query),
+                }
+            ]
+            for c in chunks_["documents"][0]
+        ]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            map_results = list(executor.map(lambda m: query_llm(m, model), map_msgs))
+        for src, res in zip(sources, map_results):
             if res.strip().lower() == "irrelevant":
-                irrelevant_srcs.append(sources[i])
+                irrelevant_srcs.append(src)
                 continue
-            context_[sources[i]] = res
+            context_[src] = res
         sources = [s for s in sources if s not in irrelevant_srcs]
         if not sources:
             return (
@@ -149,22 +554,12 @@ def rag_query(
         )
     else:
         raise ValueError(f"n_results must be >= 0 but is {n_results}.")
-    msgs = [{"role": "user", "content": prompt}]
-    res = query_llm(msgs, model)
-    logger.info(f"Got response: `{res}`.")
-    response = res + f"\n\nQuelle: {', '.join(sources)}"
-    if irrelevant_srcs:
-        response += f" (Auch geprueft: {', '.join(irrelevant_srcs)})"
-    store(
-        QuestionAnswerEntry(
-            model=model,
-            question=query,
-            context_summary=context,
-            answer=response,
-            laws=law_filter,
-        )
+    return RagPrompt(
+        prompt=prompt,
+        context=context,
+        sources=sources,
+        irrelevant_srcs=irrelevant_srcs,
     )
-    return response
 
 
 def set_law_filter(law_filter) -> dict:
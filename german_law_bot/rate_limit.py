@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Retry policy and process-wide rate limiting for OpenAI API calls"""
+import logging
+import random
+import threading
+import time
+
+from typing import (
+    Callable,
+    TypeVar,
+)
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+)
+
+from constants import (
+    RATE_LIMIT_REQUESTS_PER_MINUTE,
+    RATE_LIMIT_TOKENS_PER_MINUTE,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> None:
+        """Block until `amount` can be taken from the bucket."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.available = min(
+                    self.capacity, self.available + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Budget for both requests and tokens per minute."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = RATE_LIMIT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = RATE_LIMIT_TOKENS_PER_MINUTE,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, tokens: int) -> None:
+        self.requests.acquire()
+        self.tokens.acquire(tokens)
+
+
+limiter = RateLimiter()
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, APIConnectionError):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code in RETRYABLE_STATUS_CODES or e.status_code >= 500
+    return False
+
+
+def _retry_after(e: Exception) -> float | None:
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 1e-3), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(value) * scale
+        except ValueError:
+            continue
+    return None
+
+
+def call_with_retries(
+    fn: Callable[[], T],
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    base_delay: float = RETRY_BASE_DELAY,
+    max_delay: float = RETRY_MAX_DELAY,
+) -> T:
+    """Call `fn`, retrying transient API errors with exponential backoff and jitter.
+    A `Retry-After` header sent by the server takes precedence over the backoff.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if not _is_retryable(e) or attempt == max_attempts:
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            logger.warning(
+                f"Attempt {attempt}/{max_attempts} failed with `{e}`, "
+                f"retrying in {delay:.1f}s."
+            )
+            time.sleep(delay)
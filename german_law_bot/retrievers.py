@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""Vector search engines behind `qa.retrieve_from_vdb`.
+Each engine takes a batch of query embeddings and returns, per query, the nearest
+chunks as (id, document, metadata, distance) tuples, distances being squared L2.
+"""
+import json
+import logging
+import os
+import threading
+
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from typing import (
+    Dict,
+    List,
+)
+
+import numpy as np
+
+from constants import (
+    NUMPY_INDEX_DIR,
+    RETRIEVER,
+)
+from vector_store import (
+    collection_version,
+    get_collection,
+    laws_in,
+    stored_version,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+Hit = tuple[str, str, dict, float]
+
+
+class Retriever(ABC):
+    @abstractmethod
+    def search(
+        self, query_embeddings: List[List[float]], n: int, where: dict | None = None
+    ) -> List[List[Hit]]:
+        """Return the `n` nearest chunks for each query, nearest first."""
+
+
+class ChromaRetriever(Retriever):
+    """Queries the vector store, i.e., its HNSW index."""
+
+    def search(
+        self, query_embeddings: List[List[float]], n: int, where: dict | None = None
+    ) -> List[List[Hit]]:
+        found = get_collection().query(
+            query_embeddings=query_embeddings, n_results=n, where=where or None
+        )
+        return [
+            list(zip(ids, docs, mds, dists))
+            for ids, docs, mds, dists in zip(
+                found["ids"],
+                found["documents"],
+                found["metadatas"],
+                found["distances"],
+            )
+        ]
+
+
+class NumpyRetriever(Retriever):
+    """Exact search by matrix product over a memory-mapped copy of all embeddings.
+    Rows are grouped by law, so that a law filter selects contiguous row ranges,
+    i.e., views of the memory map rather than copies. The copy is rebuilt from the
+    vector store whenever the store changes.
+    """
+
+    def __init__(self, directory: str = NUMPY_INDEX_DIR):
+        self.directory = directory
+        self.matrix = None
+        self.sq_norms = None
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[dict] = []
+        self.ranges: Dict[str, tuple[int, int]] = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    @property
+    def paths(self) -> tuple[str, str]:
+        return (
+            os.path.join(self.directory, "embeddings.npy"),
+            os.path.join(self.directory, "chunks.jsonl"),
+        )
+
+    def build(self) -> None:
+        """Copy all chunks and embeddings from the vector store to disk, grouped by
+        law. The first line of the sidecar records the store version copied.
+        """
+        # NOTE: read before the chunks, a write in between triggers another build
+        store_version = stored_version()
+        stored = get_collection().get(include=["documents", "metadatas", "embeddings"])
+        order = sorted(
+            range(len(stored["ids"])),
+            key=lambda i: stored["metadatas"][i].get("law") or "",
+        )
+        if order:
+            matrix = np.asarray(stored["embeddings"], dtype=np.float32)[order]
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+        os.makedirs(self.directory, exist_ok=True)
+        npy_path, jsonl_path = self.paths
+        with open(npy_path + ".tmp", "wb") as f:
+            np.save(f, matrix)
+        with open(jsonl_path + ".tmp", "w", encoding="utf-8") as f:
+            header = {"store_version": store_version, "count": len(order)}
+            f.write(json.dumps(header) + "\n")
+            for i in order:
+                line = {
+                    "id": stored["ids"][i],
+                    "document": stored["documents"][i],
+                    "metadata": stored["metadatas"][i],
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        os.replace(npy_path + ".tmp", npy_path)
+        os.replace(jsonl_path + ".tmp", jsonl_path)
+        logger.info(f"Built NumPy index with {len(order)} chunks.")
+
+    def read_header(self) -> dict | None:
+        try:
+            with open(self.paths[1], encoding="utf-8") as f:
+                return json.loads(f.readline())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def load(self) -> None:
+        npy_path, jsonl_path = self.paths
+        # NOTE: an empty file cannot be memory-mapped
+        header = self.read_header() or {}
+        self.matrix = np.load(npy_path, mmap_mode="r" if header.get("count") else None)
+        with open(jsonl_path, encoding="utf-8") as f:
+            f.readline()
+            lines = [json.loads(line) for line in f]
+        self.ids = [line["id"] for line in lines]
+        self.documents = [line["document"] for line in lines]
+        self.metadatas = [line["metadata"] for line in lines]
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.ranges = {}
+        for row, md in enumerate(self.metadatas):
+            law = md.get("law") or ""
+            start, _ = self.ranges.get(law, (row, row))
+            self.ranges[law] = (start, row + 1)
+        logger.info(f"Loaded NumPy index with {len(self.ids)} chunks.")
+
+    def _refresh(self) -> None:
+        version = collection_version()
+        if version == self._version:
+            return
+        # NOTE: an index on disk is reused on first load only if it was copied from
+        # the current version of the store
+        header = self.read_header() if self._version is None else None
+        if not (
+            header
+            and version[1] is not None
+            and header.get("store_version") == version[1]
+            and header.get("count") == version[2]
+            and os.path.exists(self.paths[0])
+        ):
+            self.build()
+        self.load()
+        self._version = version
+
+    def _ranges(self, where: dict | None) -> List[tuple[int, int]]:
+        laws = laws_in(where)
+        if laws is None:
+            if where:
+                raise ValueError(f"Unsupported filter {where} for the NumPy index.")
+            return [(0, len(self.ids))]
+        return sorted(self.ranges[law] for law in set(laws) if law in self.ranges)
+
+    def search(
+        self, query_embeddings: List[List[float]], n: int, where: dict | None = None
+    ) -> List[List[Hit]]:
+        with self._lock:
+            self._refresh()
+            ranges = [
+                (start, stop) for start, stop in self._ranges(where) if stop > start
+            ]
+            if not ranges or n < 1:
+                return [[] for _ in query_embeddings]
+            queries = np.asarray(query_embeddings, dtype=np.float32)
+            sq_queries = np.einsum("ij,ij->i", queries, queries)[None, :]
+            # NOTE: |x - q|^2 = |x|^2 + |q|^2 - 2 x.q, for all pairs at once, on slices
+            # of the memory map, which are views rather than copies
+            dists = np.concatenate(
+                [
+                    self.sq_norms[start:stop, None]
+                    + sq_queries
+                    - 2 * (self.matrix[start:stop] @ queries.T)
+                    for start, stop in ranges
+                ]
+            )
+            rows = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+            k = min(n, len(rows))
+            top = np.argpartition(dists, k - 1, axis=0)[:k]
+            results = []
+            for q in range(len(queries)):
+                best = top[np.argsort(dists[top[:, q], q]), q]
+                hits = []
+                for i in best:
+                    row = int(rows[i])
+                    hits.append(
+                        (
+                            self.ids[row],
+                            self.documents[row],
+                            self.metadatas[row],
+                            max(float(dists[i, q]), 0.0),
+                        )
+                    )
+                results.append(hits)
+            return results
+
+
+RETRIEVERS = {
+    "chroma": ChromaRetriever,
+    "numpy": NumpyRetriever,
+}
+_retrievers: Dict[str, Retriever] = {}
+_retrievers_lock = threading.Lock()
+
+
+def get_retriever(name: str = RETRIEVER) -> Retriever:
+    with _retrievers_lock:
+        if name not in _retrievers:
+            _retrievers[name] = RETRIEVERS[name]()
+        return _retrievers[name]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Ingest several laws at once as a pipeline.
+Downloading and parsing run in worker processes, embedding runs in a bounded thread
+pool under the shared rate limiter, and writes to the vector store are serialized.
+"""
+import argparse
+import logging
+import threading
+
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from typing import (
+    Dict,
+    List,
+)
+
+from constants import (
+    INGEST_MAX_PARALLEL_LAWS,
+    INGEST_MAX_PROCESSES,
+)
+from ingest import (
+    Download,
+    download_validators,
+    fetch_law,
+    ingest_law,
+    laws_to_ingest,
+    peek,
+    remember_download,
+)
+from utils import load_settings
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class IngestionProgress:
+    """Tracks the stage of every law and logs a summary on each change."""
+
+    def __init__(self, laws: List[str]):
+        self.stages: Dict[str, str] = {law: "queued" for law in laws}
+        self.totals: Dict[str, int] = {}
+        self.done: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def update(self, law: str, stage: str | None = None, **counts: int) -> None:
+        with self._lock:
+            if stage:
+                self.stages[law] = stage
+            if "total" in counts:
+                self.totals[law] = counts["total"]
+            if "done" in counts:
+                self.done[law] = counts["done"]
+            logger.info(f"Ingestion progress: {self.summary()}")
+
+    def summary(self) -> str:
+        parts = []
+        for law, stage in self.stages.items():
+            if stage == "embedding" and law in self.totals:
+                stage += f" {self.done.get(law, 0)}/{self.totals[law]}"
+            parts.append(f"{law}: {stage}")
+        return ", ".join(parts)
+
+
+def _ingest(law: str, config: dict, download: Download, parags, progress) -> None:
+    progress.update(law, "embedding", total=len(parags), done=0)
+    ingest_law(
+        law,
+        config,
+        download,
+        parags,
+        on_checkpoint=lambda done: progress.update(law, done=done),
+    )
+    progress.update(law, "done")
+
+
+def load_from_config_parallel(
+    update: bool = False,
+    max_processes: int = INGEST_MAX_PROCESSES,
+    max_parallel_laws: int = INGEST_MAX_PARALLEL_LAWS,
+) -> IngestionProgress:
+    """Parallel counterpart to `ingest.load_from_config`."""
+    config = load_settings()
+    laws = laws_to_ingest(config, update)
+    progress = IngestionProgress(laws)
+    with ThreadPoolExecutor(max_workers=max_parallel_laws) as threads:
+        with ProcessPoolExecutor(max_workers=max_processes) as processes:
+            fetches = {}
+            for law in laws:
+                fetch = processes.submit(
+                    fetch_law, config[law]["link"], **download_validators(config[law])
+                )
+                fetches[fetch] = law
+                progress.update(law, "downloading and parsing")
+            ingestions = {}
+            for fetch in as_completed(fetches):
+                law = fetches[fetch]
+                try:
+                    download, parags = fetch.result()
+                except Exception as e:
+                    logger.error(f"Failed to fetch {law}: {e}")
+                    progress.update(law, "failed")
+                    continue
+                if not download.changed:
+                    remember_download(law, config, download)
+                    progress.update(law, "unchanged")
+                    continue
+                progress.update(law, "waiting for embedding", total=len(parags))
+                ingestions[
+                    threads.submit(_ingest, law, config, download, parags, progress)
+                ] = law
+        for ingestion in as_completed(ingestions):
+            law = ingestions[ingestion]
+            try:
+                ingestion.result()
+            except Exception as e:
+                logger.error(f"Failed to ingest {law}: {e}")
+                progress.update(law, "failed")
+    return progress
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="re-download loaded laws and only re-embed changed paragraphs",
+    )
+    args = parser.parse_args()
+    load_from_config_parallel(update=args.update)
+    peek()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Export and import the chunks and embeddings of a law as a compact snapshot.
+A snapshot consists of a memory-mappable `.npy` matrix of quantized embeddings and a
+JSONL sidecar, whose first line is a header followed by one line per chunk.
+"""
+import json
+import logging
+import os
+import time
+
+from typing import List
+
+import numpy as np
+
+from bm25 import bm25_index
+from constants import (
+    EMBEDDING_MODEL,
+    INGEST_CHECKPOINT_SIZE,
+    SNAPSHOT_DIR,
+    SNAPSHOT_DTYPE,
+    SNAPSHOT_VERSION,
+)
+from vector_store import (
+    get_collection,
+    mark_modified,
+    write_lock,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def snapshot_paths(law: str, directory: str = SNAPSHOT_DIR) -> tuple[str, str]:
+    base = os.path.join(directory, law)
+    return base + ".npy", base + ".jsonl"
+
+
+def quantize(embeddings: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray]:
+    """Return the quantized matrix and per-row scales, which are 1 for float16."""
+    if dtype == "float16":
+        return embeddings.astype(np.float16), np.ones(len(embeddings))
+    if dtype == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.round(embeddings / scales[:, None]).astype(np.int8), scales
+    raise ValueError(f"Unsupported snapshot dtype {dtype}.")
+
+
+def dequantize(rows: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return rows.astype(np.float32) * scales[:, None].astype(np.float32)
+
+
+def export_snapshot(
+    law: str, directory: str = SNAPSHOT_DIR, dtype: str = SNAPSHOT_DTYPE
+) -> tuple[str, str]:
+    """Write all chunks of `law` in the vector store to a snapshot."""
+    stored = get_collection().get(
+        where={"law": law}, include=["documents", "metadatas", "embeddings"]
+    )
+    if not stored["ids"]:
+        raise ValueError(f"No chunks of {law} in the vector store.")
+    embeddings = np.asarray(stored["embeddings"], dtype=np.float32)
+    matrix, scales = quantize(embeddings, dtype)
+    os.makedirs(directory, exist_ok=True)
+    npy_path, jsonl_path = snapshot_paths(law, directory)
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "law": law,
+        "model": EMBEDDING_MODEL,
+        "dtype": dtype,
+        "dim": matrix.shape[1],
+        "count": matrix.shape[0],
+        "created": time.time(),
+    }
+    # NOTE: write to temporary files first so that readers never see half a snapshot
+    with open(npy_path + ".tmp", "wb") as f:
+        np.save(f, matrix)
+    with open(jsonl_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        for id_, doc, md, scale in zip(
+            stored["ids"], stored["documents"], stored["metadatas"], scales
+        ):
+            line = {"id": id_, "document": doc, "metadata": md, "scale": float(scale)}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    os.replace(npy_path + ".tmp", npy_path)
+    os.replace(jsonl_path + ".tmp", jsonl_path)
+    logger.info(
+        f"Exported {header['count']} chunks of {law} as {dtype} to {npy_path} "
+        f"({os.path.getsize(npy_path) / 1e6:.1f} MB)."
+    )
+    return npy_path, jsonl_path
+
+
+def read_header(jsonl_path: str) -> dict:
+    with open(jsonl_path, encoding="utf-8") as f:
+        return json.loads(f.readline())
+
+
+def import_snapshot(
+    law: str,
+    directory: str = SNAPSHOT_DIR,
+    batch_size: int = INGEST_CHECKPOINT_SIZE,
+) -> int:
+    """Load a snapshot into the vector store without calling the embedding API.
+    Returns the number of imported chunks.
+    """
+    npy_path, jsonl_path = snapshot_paths(law, directory)
+    header = read_header(jsonl_path)
+    if header["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {header['version']}.")
+    if header["model"] != EMBEDDING_MODEL:
+        raise ValueError(
+            f"Snapshot was embedded with {header['model']}, not {EMBEDDING_MODEL}."
+        )
+    matrix = np.load(npy_path, mmap_mode="r")
+    if matrix.shape != (header["count"], header["dim"]):
+        raise ValueError(f"Snapshot matrix {npy_path} does not match its header.")
+    collection = get_collection()
+    imported = 0
+    with open(jsonl_path, encoding="utf-8") as f:
+        f.readline()
+        while True:
+            lines: List[dict] = [
+                json.loads(line) for _, line in zip(range(batch_size), f)
+            ]
+            if not lines:
+                break
+            rows = matrix[imported : imported + len(lines)]
+            embeddings = dequantize(rows, np.array([line["scale"] for line in lines]))
+            ids = [line["id"] for line in lines]
+            documents = [line["document"] for line in lines]
+            metadatas = [line["metadata"] for line in lines]
+            with write_lock:
+                collection.upsert(
+                    ids=ids,
+                    embeddings=embeddings.tolist(),
+                    metadatas=metadatas,
+                    documents=documents,
+                )
+                mark_modified()
+            bm25_index.add(ids, documents, [md["law"] for md in metadatas])
+            imported += len(lines)
+            logger.info(f"Imported {imported}/{header['count']} chunks of {law}.")
+    if imported != header["count"]:
+        raise ValueError(f"Snapshot sidecar {jsonl_path} does not match its header.")
+    bm25_index.save()
+    return imported
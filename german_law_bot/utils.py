@@ -10,17 +10,51 @@ from constants import (
     CONFIG,
     EMBEDDING_MODEL,
 )
+from embedding_cache import EmbeddingCache
+from rate_limit import (
+    call_with_retries,
+    limiter,
+)
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-oai_client = OpenAI()
+# NOTE: retries are handled by `call_with_retries`
+oai_client = OpenAI(max_retries=0)
+embedding_cache = EmbeddingCache()
 
 
 def get_embedding(text: str, model: str = EMBEDDING_MODEL) -> List[float]:
-    return oai_client.embeddings.create(input=[text], model=model).data[0].embedding
+    return get_embeddings([text], model=model)[0]
+
+
+def get_embeddings(texts: List[str], model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    """Embed several texts with a single request, preserving the input order.
+    Texts already in the embedding cache are not sent to the API.
+    """
+    if not texts:
+        return []
+    cached = embedding_cache.get_many(model, texts)
+    missing = [i for i in range(len(texts)) if i not in cached]
+    if missing:
+        inputs = [texts[i] for i in missing]
+
+        def create():
+            limiter.acquire(sum(estimate_tokens(t) for t in inputs))
+            return oai_client.embeddings.create(input=inputs, model=model)
+
+        data = call_with_retries(create).data
+        fetched = [d.embedding for d in sorted(data, key=lambda d: d.index)]
+        embedding_cache.put_many(model, inputs, fetched)
+        cached.update(zip(missing, fetched))
+    return [cached[i] for i in range(len(texts))]
+
+
+def estimate_tokens(text: str) -> int:
+    # NOTE: rough upper bound, German text averages a little over 3 chars per token
+    return len(text) // 3 + 1
 
 
 def load_settings(config: str = CONFIG) -> dict:
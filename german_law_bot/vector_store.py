@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""Process-wide access to the persistent vector store"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Dict,
+    List,
+)
+
+import chromadb
+from chromadb.api.client import SharedSystemClient
+from chromadb.api.models.Collection import Collection
+
+from constants import (
+    CHROMA_DIR,
+    COLLECTION_NAME,
+    OPENAI_EF,
+    SHARD_QUERY_WORKERS,
+    SHARDED_STORE,
+    STORE_VERSION,
+)
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+_lock = threading.RLock()
+# NOTE: serializes writes, e.g., when several laws are ingested concurrently
+write_lock = threading.Lock()
+_client = None
+_collection = None
+_version = 0
+
+
+def shard_name(law: str) -> str:
+    """Collection name for a code of law, within chroma's naming rules."""
+    digest = hashlib.sha1(law.encode()).hexdigest()[:8]
+    return f"{COLLECTION_NAME}_{re.sub(r'[^A-Za-z0-9]', '-', law)[:40]}_{digest}"
+
+
+def laws_in(where: dict | None) -> List[str] | None:
+    """Laws selected by a filter of the form built by `qa.set_law_filter`."""
+    if not where:
+        return None
+    if list(where) == ["law"] and isinstance(where["law"], str):
+        return [where["law"]]
+    if list(where) == ["$or"] and all(list(c) == ["law"] for c in where["$or"]):
+        return [c["law"] for c in where["$or"]]
+    return None
+
+
+def _concat(results: List[dict], keys: List[str]) -> dict:
+    merged = {}
+    for key in keys:
+        parts = [r.get(key) for r in results]
+        merged[key] = (
+            None
+            if any(p is None for p in parts)
+            else [item for p in parts for item in p]
+        )
+    return merged
+
+
+class ShardedCollection:
+    """Stores each code of law in a collection of its own.
+    Offers the subset of the `Collection` interface used in this project, so it can be
+    used in its place. Law filters select shards instead of filtering metadata, queries
+    fan out to the selected shards in parallel and are merged by distance, and deleting
+    a law drops its collection.
+    """
+
+    def __init__(self, client, max_workers: int = SHARD_QUERY_WORKERS):
+        self.client = client
+        self.max_workers = max_workers
+        self.shards: Dict[str, Collection] = {}
+        self._lock = threading.Lock()
+        for c in client.list_collections():
+            if c.name.startswith(COLLECTION_NAME + "_") and (c.metadata or {}).get(
+                "law"
+            ):
+                self.shards[c.metadata["law"]] = client.get_collection(
+                    name=c.name, embedding_function=OPENAI_EF
+                )
+
+    def _shard(self, law: str) -> Collection:
+        with self._lock:
+            if law not in self.shards:
+                self.shards[law] = self.client.get_or_create_collection(
+                    name=shard_name(law),
+                    embedding_function=OPENAI_EF,
+                    metadata={"law": law},
+                )
+            return self.shards[law]
+
+    def _select(self, where: dict | None) -> tuple[List[Collection], dict | None]:
+        laws = laws_in(where)
+        with self._lock:
+            if laws is None:
+                return list(self.shards.values()), where or None
+            return [self.shards[law] for law in laws if law in self.shards], None
+
+    def count(self) -> int:
+        with self._lock:
+            shards = list(self.shards.values())
+        return sum(s.count() for s in shards)
+
+    def peek(self, limit: int = 10) -> dict:
+        shards, _ = self._select(None)
+        return shards[0].peek(limit) if shards else {}
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None) -> None:
+        by_law = {}
+        for i, md in enumerate(metadatas):
+            by_law.setdefault(md["law"], []).append(i)
+        for law, rows in by_law.items():
+            self._shard(law).upsert(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows] if embeddings else None,
+                metadatas=[metadatas[i] for i in rows],
+                documents=[documents[i] for i in rows] if documents else None,
+            )
+
+    def get(self, ids=None, where=None, include=None, **kwargs) -> dict:
+        shards, where = self._select(where)
+        include = include or ["metadatas", "documents"]
+        results = [
+            s.get(ids=ids, where=where, include=include, **kwargs) for s in shards
+        ]
+        return _concat(results, ["ids"] + include)
+
+    def query(self, query_embeddings, n_results: int = 10, where=None, **kwargs):
+        shards, where = self._select(where)
+        shards = [s for s in shards if s.count()]
+        include = kwargs.pop("include", ["metadatas", "documents", "distances"])
+        keys = ["ids"] + [k for k in include if k != "distances"]
+
+        def query_shard(shard: Collection) -> dict:
+            return shard.query(
+                query_embeddings=query_embeddings,
+                n_results=min(n_results, shard.count()),
+                where=where,
+                include=include + ["distances"] * ("distances" not in include),
+                **kwargs,
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(query_shard, shards))
+        merged = {key: [] for key in keys + ["distances"]}
+        for q in range(len(query_embeddings)):
+            rows = [
+                (r["distances"][q][i], [r[k][q][i] for k in keys])
+                for r in results
+                for i in range(len(r["ids"][q]))
+            ]
+            rows = sorted(rows, key=lambda row: row[0])[:n_results]
+            merged["distances"].append([row[0] for row in rows])
+            for j, key in enumerate(keys):
+                merged[key].append([row[1][j] for row in rows])
+        for key in ("metadatas", "documents", "embeddings"):
+            merged.setdefault(key, None)
+        return merged
+
+    def delete(self, ids=None, where=None) -> None:
+        laws = laws_in(where)
+        if laws is not None and ids is None:
+            for law in laws:
+                with self._lock:
+                    shard = self.shards.pop(law, None)
+                if shard is not None:
+                    self.client.delete_collection(shard.name)
+                    logger.info(f"Dropped collection {shard.name} for {law}.")
+            return
+        shards, where = self._select(where)
+        for s in shards:
+            s.delete(ids=ids, where=where)
+
+
+def get_collection() -> Collection | ShardedCollection:
+    """Return the shared collection handle, opening the store on first use."""
+    global _client, _collection
+    with _lock:
+        if _collection is None:
+            _client = chromadb.PersistentClient(path=CHROMA_DIR)
+            if SHARDED_STORE:
+                _collection = ShardedCollection(_client)
+            else:
+                _collection = _client.get_or_create_collection(
+                    name=COLLECTION_NAME, embedding_function=OPENAI_EF
+                )
+            logger.info(f"Opened vector store at {CHROMA_DIR}.")
+        return _collection
+
+
+def close() -> None:
+    """Release the store, e.g., before exiting or removing its files.
+    Only call this when no other thread uses the collection anymore, writes in this
+    process are visible to its readers without closing and reopening the store.
+    """
+    global _client, _collection
+    with _lock:
+        if _client is None:
+            return
+        # NOTE: chromadb 0.4 has no public close, stopping the system releases the
+        # SQLite connection and the HNSW segments
+        try:
+            _client._system.stop()
+        finally:
+            SharedSystemClient.clear_system_cache()
+            _client, _collection = None, None
+        logger.info("Closed vector store.")
+
+
+def mark_modified() -> None:
+    """Record a write, e.g., to invalidate answers derived from the old contents.
+    The write is also recorded in `STORE_VERSION` for other processes, e.g., the
+    frontend while `ingest.py --update` runs.
+    """
+    global _version
+    with _lock:
+        _version += 1
+        stamp = f"{os.getpid()}-{time.time_ns()}-{_version}"
+        os.makedirs(os.path.dirname(STORE_VERSION), exist_ok=True)
+        tmp = f"{STORE_VERSION}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(stamp)
+        os.replace(tmp, STORE_VERSION)
+
+
+def stored_version() -> str | None:
+    """The stamp of the last write by any process, None for stores without one."""
+    try:
+        with open(STORE_VERSION) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def collection_version() -> tuple[int, str | None, int]:
+    """Changes whenever this or another process writes to the store."""
+    return _version, stored_version(), get_collection().count()
+
+
+def shard_collection(batch_size: int = 1_000) -> int:
+    """Move the contents of the single collection into one collection per law.
+    Set `SHARDED_STORE` afterwards. Returns the number of moved chunks.
+    """
+    client = chromadb.PersistentClient(path=CHROMA_DIR)
+    source = client.get_or_create_collection(
+        name=COLLECTION_NAME, embedding_function=OPENAI_EF
+    )
+    target = ShardedCollection(client)
+    moved = 0
+    with write_lock:
+        while True:
+            batch = source.get(
+                limit=batch_size,
+                offset=moved,
+                include=["embeddings", "metadatas", "documents"],
+            )
+            if not batch["ids"]:
+                break
+            target.upsert(
+                ids=batch["ids"],
+                embeddings=batch["embeddings"],
+                metadatas=batch["metadatas"],
+                documents=batch["documents"],
+            )
+            moved += len(batch["ids"])
+            logger.info(f"Moved {moved} chunks into per-law collections.")
+        client.delete_collection(COLLECTION_NAME)
+        mark_modified()
+    logger.info(f"Sharded {moved} chunks into {len(target.shards)} collections.")
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--shard",
+        action="store_true",
+        help="move the single collection into one collection per law",
+    )
+    args = parser.parse_args()
+    if args.shard:
+        shard_collection()
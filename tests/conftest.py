@@ -0,0 +1,7 @@
+import os
+import sys
+
+# NOTE: the modules import each other as top-level modules, as when run from their dir
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "german_law_bot"))
+# NOTE: required at import time only, the tests make no API calls
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,77 @@
+import pytest
+
+from bm25 import (
+    BM25Index,
+    split_compound,
+    tokenize,
+)
+
+
+@pytest.mark.parametrize(
+    "token, vocabulary, expected",
+    [
+        ("widerrufsfrist", {"widerruf", "frist"}, ["widerruf", "frist"]),
+        ("kaufvertrag", {"kauf", "vertrag"}, ["kauf", "vertrag"]),
+        (
+            "verbraucherdarlehensvertrag",
+            {"verbraucher", "darlehen", "vertrag"},
+            ["verbraucher", "darlehen", "vertrag"],
+        ),
+        ("widerrufsfrist", {"frist"}, []),
+        ("frist", {"frist"}, []),
+    ],
+)
+def test_split_compound(token, vocabulary, expected):
+    assert split_compound(token, vocabulary) == expected
+
+
+def test_tokenize_drops_stopwords_and_stems():
+    assert tokenize("Der Käufer ist verpflichtet, den Kaufpreis zu zahlen.") == [
+        "käuf",
+        "verpflichtet",
+        "kaufprei",
+        "zahl",
+    ]
+    assert tokenize("Straße") == ["strass"]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = BM25Index(path=str(tmp_path / "bm25.pickle"))
+    index.add(
+        ["BGB_355", "BGB_356", "BGB_199", "GG_1"],
+        [
+            "Die Widerrufsfrist beträgt vierzehn Tage.",
+            "Der Widerruf erfolgt durch Erklärung gegenüber dem Unternehmer.",
+            "Die Frist beginnt mit dem Schluss des Jahres.",
+            "Die Würde des Menschen ist unantastbar.",
+        ],
+        ["BGB", "BGB", "BGB", "GG"],
+    )
+    return index
+
+
+def test_search_ranks_compound_match_first(index):
+    hits = index.search("Widerrufsfrist", 4)
+    assert hits[0][0] == "BGB_355"
+    assert {id_ for id_, _ in hits} == {"BGB_355", "BGB_356", "BGB_199"}
+    assert [score for _, score in hits] == sorted(
+        (score for _, score in hits), reverse=True
+    )
+
+
+def test_search_respects_n_and_law_filter(index):
+    assert len(index.search("Widerrufsfrist", 1)) == 1
+    assert index.search("Würde", 4, laws=["BGB"]) == []
+    assert [id_ for id_, _ in index.search("Würde", 4, laws=["GG"])] == ["GG_1"]
+
+
+def test_save_reload_and_remove_law(index):
+    index.save()
+    reloaded = BM25Index(path=index.path)
+    assert reloaded.search("Würde", 4) == index.search("Würde", 4)
+    index.remove_law("BGB")
+    assert index.search("Widerrufsfrist", 4) == []
+    assert index.total_length == len(
+        tokenize("Die Würde des Menschen ist unantastbar.")
+    )
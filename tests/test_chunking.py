@@ -0,0 +1,82 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from ingest import (
+    chunk_structured,
+    extract_xml,
+    parse_units,
+    split_structured,
+    split_unit,
+)
+from utils import estimate_tokens
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.fixture
+def parags():
+    return list(extract_xml(DATA_DIR, "sample.xml"))
+
+
+def test_parse_units_splits_numbered_items():
+    block = ET.fromstring(
+        "<P>(3) Es gilt:<DL Type='arabic'><DT>1.</DT><DD><LA>erster Fall,</LA></DD>"
+        "<DT>2.</DT><DD><LA>zweiter Fall.</LA></DD></DL> Schluss.</P>"
+    )
+    assert parse_units(block) == [
+        "(3) Es gilt:",
+        "1. erster Fall,",
+        "2. zweiter Fall.",
+        "Schluss.",
+    ]
+
+
+def test_extract_xml_tracks_sections(parags):
+    assert [(p.par, p.section) for p in parags] == [
+        ("§ 1", "Buch 1 Allgemeiner Teil"),
+        ("§ 2", "Buch 1 Allgemeiner Teil"),
+        ("§ 3", "Buch 1 Allgemeiner Teil"),
+        ("§ 4", "Buch 1 Allgemeiner Teil"),
+        ("§ 355", "Buch 2 Recht der Schuldverhältnisse"),
+        ("§ 433", "Buch 2 Recht der Schuldverhältnisse"),
+    ]
+    assert parags[4].units[-2:] == ["1. erster Fall,", "2. zweiter Fall."]
+
+
+def test_split_unit_at_sentences():
+    unit = "Erster Satz mit einigen Worten. Zweiter Satz mit einigen Worten."
+    assert split_unit(unit, 100) == [unit]
+    assert split_unit(unit, 12) == [
+        "Erster Satz mit einigen Worten.",
+        "Zweiter Satz mit einigen Worten.",
+    ]
+
+
+def test_split_structured_respects_max_tokens(parags):
+    norm = parags[4]
+    assert split_structured(norm, 1_500) == [norm]
+    parts = split_structured(norm, 60)
+    assert [p.par for p in parts] == [f"§ 355 Teil {i}" for i in range(1, 8)]
+    assert all(estimate_tokens(p.document) <= 60 for p in parts)
+    assert all(p.section == norm.section for p in parts)
+    assert " ".join(" ".join(p.units) for p in parts).split() == (
+        " ".join(norm.units).split()
+    )
+
+
+def test_chunk_structured_merges_short_norms_and_drops_duplicates(parags):
+    chunks = list(chunk_structured(parags, max_tokens=1_500, min_tokens=100))
+    assert [c.par for c in chunks] == ["§ 1, § 2, § 3", "§ 355", "§ 433"]
+    assert chunks[0].text.startswith("§ 1 Die Rechtsfähigkeit")
+    assert chunks[0].footnotes == "Fußnote zu § 2"
+
+
+def test_chunk_structured_does_not_merge_across_sections(parags):
+    chunks = list(chunk_structured(parags, max_tokens=1_500, min_tokens=1_000))
+    assert [(c.par, c.section) for c in chunks] == [
+        ("§ 1, § 2, § 3", "Buch 1 Allgemeiner Teil"),
+        ("§ 355, § 433", "Buch 2 Recht der Schuldverhältnisse"),
+    ]
@@ -0,0 +1,36 @@
+import pytest
+
+from citations import parse_citations
+
+
+KNOWN_LAWS = ["BGB", "GG", "HGB"]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("Was regelt § 433 BGB?", [("bgb", "433")]),
+        ("§433BGB", [("bgb", "433")]),
+        ("§§ 433, 434 BGB", [("bgb", "433"), ("bgb", "434")]),
+        ("§ 433 und § 434 BGB", [("bgb", "433"), ("bgb", "434")]),
+        ("§§ 433 ff. BGB", [("bgb", "433")]),
+        ("§ 433 f. BGB", [("bgb", "433")]),
+        ("§ 433 Abs. 1 S. 2 BGB", [("bgb", "433")]),
+        ("§ 433 Abs. 1 und § 434 Abs. 2 BGB", [("bgb", "433"), ("bgb", "434")]),
+        ("Art. 20a des GG", [("gg", "20a")]),
+        ("Artikel 1 GG", [("gg", "1")]),
+        ("§ 20 a GG", [("gg", "20a")]),
+        ("§ 1 HGB und § 433 BGB", [("hgb", "1"), ("bgb", "433")]),
+    ],
+)
+def test_parse_citations(query, expected):
+    assert parse_citations(query, KNOWN_LAWS) == expected
+
+
+def test_parse_citations_ignores_unknown_laws():
+    assert parse_citations("§ 1 StGB", KNOWN_LAWS) == []
+    assert parse_citations("§ 1 Satz 2", KNOWN_LAWS) == []
+
+
+def test_parse_citations_deduplicates():
+    assert parse_citations("§ 433 BGB, siehe § 433 BGB", KNOWN_LAWS) == [("bgb", "433")]
@@ -0,0 +1,67 @@
+from qa import (
+    CONTEXT_BUDGET_TOKENS,
+    gate_chunks,
+    pack_context,
+)
+
+
+def make_chunks(rows):
+    """Build a vector store query result from (id, document, distance) rows."""
+    return {
+        "ids": [[r[0] for r in rows]],
+        "documents": [[r[1] for r in rows]],
+        "metadatas": [[{"law": "BGB"} for _ in rows]],
+        "distances": [[r[2] for r in rows]],
+    }
+
+
+QUERY = "Was regelt § 433 BGB zur Widerrufsfrist beim Widerruf?"
+ROWS = [
+    ("BGB_433", "Der Verkäufer ist verpflichtet, die Sache zu übergeben.", 0.0),
+    ("BGB_356", "Die Frist beginnt mit Vertragsschluss.", 0.8),
+    ("BGB_355", "Der Widerruf erfolgt innerhalb der Widerrufsfrist.", 0.9),
+]
+
+
+def test_gate_chunks_keeps_pinned_chunks_in_front():
+    gated = gate_chunks(QUERY, make_chunks(ROWS), lexical_rerank=True)
+    assert gated["ids"][0] == ["BGB_433", "BGB_355", "BGB_356"]
+
+
+def test_gate_chunks_never_drops_pinned_chunks():
+    gated = gate_chunks(QUERY, make_chunks(ROWS), max_distance=0.5, min_overlap=0.5)
+    assert gated["ids"][0] == ["BGB_433"]
+
+
+def test_gate_chunks_keeps_ranking_without_rerank():
+    gated = gate_chunks(QUERY, make_chunks(ROWS), lexical_rerank=False)
+    assert gated["ids"][0] == ["BGB_433", "BGB_356", "BGB_355"]
+
+
+def test_gate_chunks_keeps_closest_chunk():
+    gated = gate_chunks(QUERY, make_chunks(ROWS[1:]), max_distance=0.5)
+    assert gated["ids"][0] == ["BGB_356"]
+
+
+def test_pack_context_never_drops_pinned_chunks():
+    chunks = make_chunks([ROWS[1], ROWS[2], ROWS[0]])
+    chunks["metadatas"][0] = [{"tokens": 200}, {"tokens": 200}, {"tokens": 200}]
+    CONTEXT_BUDGET_TOKENS["test-model"] = 300
+    try:
+        context, ids = pack_context(chunks, "test-model")
+        assert ids == ["BGB_433"]
+        assert context.startswith("BGB_433: Der Verkäufer")
+        CONTEXT_BUDGET_TOKENS["test-model"] = 100
+        assert pack_context(chunks, "test-model") is None
+    finally:
+        del CONTEXT_BUDGET_TOKENS["test-model"]
+
+
+def test_pack_context_keeps_top_chunks_within_budget():
+    chunks = make_chunks(ROWS[1:])
+    context, ids = pack_context(chunks, "gpt-4")
+    assert ids == ["BGB_356", "BGB_355"]
+    assert context == (
+        "BGB_356: Die Frist beginnt mit Vertragsschluss.\n\n"
+        "BGB_355: Der Widerruf erfolgt innerhalb der Widerrufsfrist."
+    )
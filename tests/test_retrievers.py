@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+import retrievers
+from retrievers import NumpyRetriever
+
+
+class FakeCollection:
+    """Serves stored chunks like `get_collection()`, without a vector store."""
+
+    def __init__(self, ids, documents, metadatas, embeddings):
+        self.stored = {
+            "ids": ids,
+            "documents": documents,
+            "metadatas": metadatas,
+            "embeddings": embeddings,
+        }
+
+    def get(self, include):
+        return self.stored
+
+    def count(self):
+        return len(self.stored["ids"])
+
+
+def use_store(monkeypatch, collection, version="1"):
+    monkeypatch.setattr(retrievers, "get_collection", lambda: collection)
+    monkeypatch.setattr(retrievers, "stored_version", lambda: version)
+    monkeypatch.setattr(
+        retrievers,
+        "collection_version",
+        lambda: (0, version, collection.count()),
+    )
+
+
+@pytest.fixture
+def store(monkeypatch):
+    rng = np.random.default_rng(0)
+    laws = ["BGB", "GG", "HGB"] * 10
+    rng.shuffle(laws)
+    embeddings = rng.normal(size=(len(laws), 8)).astype(np.float32)
+    collection = FakeCollection(
+        ids=[f"{law}_{i}" for i, law in enumerate(laws)],
+        documents=[f"Text {i}" for i in range(len(laws))],
+        metadatas=[{"law": law} for law in laws],
+        embeddings=embeddings.tolist(),
+    )
+    use_store(monkeypatch, collection)
+    return collection
+
+
+def brute_force(collection, query, n, laws=None):
+    stored = collection.stored
+    dists = np.sum((np.asarray(stored["embeddings"]) - query) ** 2, axis=1)
+    rows = [
+        i
+        for i in np.argsort(dists, kind="stable")
+        if laws is None or stored["metadatas"][i]["law"] in laws
+    ]
+    return [stored["ids"][i] for i in rows[:n]]
+
+
+@pytest.mark.parametrize(
+    "where, laws",
+    [
+        (None, None),
+        ({"law": "GG"}, ["GG"]),
+        ({"$or": [{"law": "BGB"}, {"law": "HGB"}]}, ["BGB", "HGB"]),
+    ],
+)
+def test_search_matches_brute_force(tmp_path, store, where, laws):
+    retriever = NumpyRetriever(str(tmp_path))
+    queries = np.random.default_rng(1).normal(size=(4, 8)).astype(np.float32)
+    results = retriever.search(queries.tolist(), 5, where)
+    assert len(results) == len(queries)
+    for query, hits in zip(queries, results):
+        assert [h[0] for h in hits] == brute_force(store, query, 5, laws)
+        assert [h[3] for h in hits] == sorted(h[3] for h in hits)
+        assert all(laws is None or h[2]["law"] in laws for h in hits)
+
+
+def test_rows_are_grouped_by_law(tmp_path, store):
+    retriever = NumpyRetriever(str(tmp_path))
+    retriever.search([[0.0] * 8], 1)
+    assert sorted(retriever.ranges.values()) == [(0, 10), (10, 20), (20, 30)]
+    for law, (start, stop) in retriever.ranges.items():
+        assert {md["law"] for md in retriever.metadatas[start:stop]} == {law}
+
+
+def test_index_on_disk_is_reused_only_for_same_version(tmp_path, store, monkeypatch):
+    NumpyRetriever(str(tmp_path)).search([[0.0] * 8], 1)
+    built = []
+    build = NumpyRetriever.build
+    monkeypatch.setattr(
+        NumpyRetriever, "build", lambda self: built.append(True) or build(self)
+    )
+    NumpyRetriever(str(tmp_path)).search([[0.0] * 8], 1)
+    assert not built
+    use_store(monkeypatch, store, version="2")
+    NumpyRetriever(str(tmp_path)).search([[0.0] * 8], 1)
+    assert built
+
+
+def test_search_on_empty_store(tmp_path, monkeypatch):
+    use_store(monkeypatch, FakeCollection([], [], [], []))
+    retriever = NumpyRetriever(str(tmp_path))
+    assert retriever.search([[0.0] * 8, [1.0] * 8], 3) == [[], []]
+    assert retriever.search([[0.0] * 8], 3, {"law": "BGB"}) == [[]]